@@ -136,13 +136,12 @@ def projectShape(shapesModel, shapes, num_params, leterList):
 
     for leter in shapesModel:
         for shape in shapes:
-            if leter == shape:
-                i=0
-                for sample in range(len(shapes[shape])):                
-                    projShape = shapesModel[leter].decomposeShape(shapes[leter][sample])
-                    i = i+1
-                    projShapes[leter].append(projShape[0][0:])
-                #print '%s: is present in both with %i samples' % (leter,i)
+            if leter == shape and len(shapes[shape]) > 0:
+                #Project all the samples of the shape at once
+                samples = np.hstack(shapes[leter]).T
+                params = shapesModel[leter].decomposeShapes(samples)
+                projShapes[leter].extend(np.reshape(p, (-1, 1)) for p in params)
+                #print '%s: is present in both with %i samples' % (leter,len(samples))
     
     return projShapes
 
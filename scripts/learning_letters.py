@@ -4,6 +4,8 @@
 from shape_learning.shape_learner_manager import ShapeLearnerManager
 from shape_learning.shape_learner import SettingsStruct
 from shape_learning.shape_modeler import ShapeModeler #for normaliseShapeHeight()
+from shape_learning import shape_plotting
+from shape_learning.param_store import getParamStore
 
 import os.path
 
@@ -149,26 +151,11 @@ def generateSettings(shapeType):
         except IOError:
                     raise RuntimeError("no writing permission for file"+demo_datasetFile)
 
-    try:
-        datasetParam = init_datasetDirectory + '/params.dat'
-        with open(datasetParam, 'r') as f:
-            line = f.readline()
-            test = line.replace('[','').replace(']\n','')==shapeType
-            while test==False:
-                line = f.readline()
-                if line:
-                    test = line.replace('[','').replace(']\n','')==shapeType
-                else:
-                    break
-            if test:
-                u = f.readline().replace('\n','')
-                initialParamValue = [(float)(s) for s in u.split(',')]
-            else:
-                initialParamValue = [0.0,0.0,0.0,0.0,0.0]
-                print("parameters not found for shape "+ shapeType +'\n'+'Default : 0.0')
-
-    except IOError:
-        raise RuntimeError("no reading permission for file"+datasetParam)
+    datasetParam = init_datasetDirectory + '/params.dat'
+    initialParamValue = getParamStore(datasetParam).getParams(shapeType)
+    if initialParamValue is None:
+        initialParamValue = [0.0,0.0,0.0,0.0,0.0]
+        print("parameters not found for shape "+ shapeType +'\n'+'Default : 0.0')
 
     settings = SettingsStruct(shape_learning = shapeType,
                                 paramsToVary = paramsToVary, 
@@ -185,7 +172,7 @@ def generateSettings(shapeType):
 def showShape(shape,shapeIndex ):
     plt.figure(shapeIndex+1)
     plt.clf()
-    ShapeModeler.normaliseAndShowShape(shape.path)
+    shape_plotting.normaliseAndShowShape(shape.path)
 
 if __name__ == "__main__":
     #parse arguments
@@ -205,7 +192,8 @@ if __name__ == "__main__":
     if not os.path.exists(update_datasetDirectory):
         os.makedir(update_datasetDirectory)
 
-    wordManager = ShapeLearnerManager(generateSettings)
+    # save in the background, so that touch events are not delayed by the disk
+    wordManager = ShapeLearnerManager(generateSettings, async_saves=True)
     wordSeenBefore = wordManager.newCollection(wordToLearn)
 
 
@@ -220,3 +208,5 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
             # ShapeModeler.save()
             logger.info("Bye bye")
+    finally:
+        wordManager.close()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from shape_learning.shape_modeler import ShapeModeler
+from shape_learning import learning_simulator
+
+import os.path
+import time
+
+import numpy as np
+
+import argparse
+parser = argparse.ArgumentParser(description='Simulate learning sessions of letters with various settings, '
+                                             'the feedback being given by ShapeLearner.generateSimulatedFeedback')
+parser.add_argument('letters', action="store",
+                help='The letters to learn')
+parser.add_argument('output', action="store",
+                help='The .npz file where the results are saved (one array per column)')
+parser.add_argument('--dataset_directory', action="store",
+                help='The directory of the datasets to start the learning from (a.npy or a.dat for the letter a)')
+parser.add_argument('--min_param_diffs', action="store", nargs='+', type=float, default=[0.4],
+                help='The values of minParamDiff to try')
+parser.add_argument('--bounds', action="store", nargs='+', type=float, default=[6],
+                help='The initial bounds to try, in multiples of the standard deviation of the parameter')
+parser.add_argument('--modes', action="store", nargs='+', choices=['groupwise', 'pairwise'], default=['groupwise'],
+                help='The comparison modes to try')
+parser.add_argument('--strategies', action="store", nargs='+', default=['random'],
+                help='The search strategies to try (random, or one of shape_learner.SEARCH_STRATEGIES)')
+parser.add_argument('--param_to_vary', action="store", type=int, default=3,
+                help='The (1-based) index of the learned parameter')
+parser.add_argument('--repeats', action="store", type=int, default=10,
+                help='The number of sessions with each combination of settings')
+parser.add_argument('--max_iterations', action="store", type=int, default=100,
+                help='The number of feedbacks after which a session is stopped')
+parser.add_argument('--processes', action="store", type=int,
+                help='The number of processes running the sessions (default: the number of CPUs)')
+parser.add_argument('--seed', action="store", type=int, default=0,
+                help='The seed of the first session (the others follow)')
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    datasetDirectory = args.dataset_directory
+    if(not datasetDirectory):
+        import inspect
+        fileName = inspect.getsourcefile(ShapeModeler)
+        installDirectory = fileName.split('/lib')[0]
+        datasetDirectory = installDirectory + '/share/shape_learning/letter_model_datasets/alexis_set_for_children'
+
+    datasetFiles = {}
+    for letter in args.letters:
+        #prefer the binary dataset, much faster to load in every session
+        for extension in ['.npy', '.dat']:
+            datasetFile = os.path.join(datasetDirectory, letter + extension)
+            if os.path.exists(datasetFile):
+                datasetFiles[letter] = datasetFile
+                break
+        else:
+            raise RuntimeError("no dataset for letter " + letter + " in " + datasetDirectory)
+
+    sessions = learning_simulator.makeSessions(datasetFiles,
+                                               paramToVary=args.param_to_vary,
+                                               minParamDiffs=args.min_param_diffs,
+                                               boundsStdDevMultiples=args.bounds,
+                                               groupwiseModes=[mode == 'groupwise' for mode in args.modes],
+                                               searchStrategies=args.strategies,
+                                               numRepeats=args.repeats,
+                                               maxIterations=args.max_iterations,
+                                               seed=args.seed)
+    print('simulating %d sessions...' % len(sessions))
+    startTime = time.time()
+    results = learning_simulator.runSessions(sessions, args.processes)
+    print('done in %.1fs' % (time.time() - startTime))
+    learning_simulator.saveResults(results, args.output)
+
+    #summary per combination of settings
+    columns = learning_simulator.loadResults(args.output)
+    numErrors = np.sum(columns['error'] != '')
+    if numErrors:
+        print('%d sessions failed, e.g. %s' % (numErrors, columns['error'][columns['error'] != ''][0]))
+    settingsFields = ['shape', 'minParamDiff', 'boundsStdDevMultiple', 'groupwise', 'searchStrategy']
+    combinations = sorted(set(zip(*[columns[field].tolist() for field in settingsFields])))
+    for combination in combinations:
+        selected = np.all([columns[field] == value for field, value in zip(settingsFields, combination)], axis=0)
+        print('%s: converged %d/%d, %.1f iterations on average' % (
+              ', '.join('%s=%s' % (field, value) for field, value in zip(settingsFields, combination)),
+              np.sum(columns['converged'][selected]), np.sum(selected),
+              np.mean(columns['numIterations'][selected])))
@@ -4,6 +4,9 @@
 from shape_learning.shape_learner_manager import ShapeLearnerManager
 from shape_learning.shape_learner import SettingsStruct
 from shape_learning.shape_modeler import ShapeModeler #for normaliseShapeHeight()
+from shape_learning import shape_plotting
+from shape_learning.param_store import getParamStore
+from shape_learning.shape_model_bank import ShapeModelBank
 
 import os.path
 
@@ -57,26 +60,11 @@ def generateSettings(shapeType):
         except IOError:
                     raise RuntimeError("no writing permission for file"+demo_datasetFile)
 
-    try:
-        datasetParam = init_datasetDirectory + '/params.dat'
-        with open(datasetParam, 'r') as f:
-            line = f.readline()
-            test = line.replace('[','').replace(']\n','')==shapeType
-            while test==False:
-                line = f.readline()
-                if line:
-                    test = line.replace('[','').replace(']\n','')==shapeType
-                else:
-                    break
-            if test:
-                u = f.readline().replace('\n','')
-                initialParamValue = [(float)(s) for s in u.split(',')]
-            else:
-                initialParamValue = [0.0,0.0,0.0,0.0,0.0]
-                print("parameters not found for shape "+ shapeType +'\n'+'Default : 0.0')
-
-    except IOError:
-        raise RuntimeError("no reading permission for file"+datasetParam)
+    datasetParam = init_datasetDirectory + '/params.dat'
+    initialParamValue = getParamStore(datasetParam).getParams(shapeType)
+    if initialParamValue is None:
+        initialParamValue = [0.0,0.0,0.0,0.0,0.0]
+        print("parameters not found for shape "+ shapeType +'\n'+'Default : 0.0')
 
     settings = (shapeType, init_datasetFile, [update_datasetFile,demo_datasetFile], datasetParam)
 
@@ -94,6 +82,13 @@ if not os.path.exists(init_datasetDirectory):
     raise RuntimeError("initial dataset directory not found !")
 if not os.path.exists(update_datasetDirectory):
     os.makedir(update_datasetDirectory)
+# clusters of the letters cached between runs, out of the installed datasets
+clusters_cacheDirectory = os.path.join(os.path.expanduser('~'), '.cache', 'shape_learning', 'clusters')
+if not os.path.exists(clusters_cacheDirectory):
+    try:
+        os.makedirs(clusters_cacheDirectory)
+    except OSError:
+        pass # the clusters are then recomputed at each run
 
 
 numPoints_shapeModeler = 70
@@ -116,6 +111,16 @@ for letter in abc:
                                 update_filenames=update_datasetFiles,
                                 param_filename=datasetParam,
                                 num_principle_components=nb_param)
+    # reuse the clusters computed at the previous run, if the dataset did not change
+    clustersFile = os.path.join(clusters_cacheDirectory, letter + '.clusters.npz')
+    if not spaces[letter].loadClusters(clustersFile):
+        try:
+            spaces[letter].saveClusters(clustersFile)
+        except RuntimeError:
+            pass
+
+# all the letter models stacked, to score the segments against all letters at once
+bank = ShapeModelBank(spaces)
 
 
 def downsampleShape(shape,numDesiredPoints,xyxyFormat=False):
@@ -205,29 +210,22 @@ class MyPaintWidget(Widget):
                         scores[i] = 0
 
         plt.clf()
-        ShapeModeler.showShape_score(scan,scores)
+        shape_plotting.showShape_score(scan,scores)
 
         word = []
 
         sep = indices[scores>0]
+        segments = []
         for i,j in zip(sep[:-1],sep[1:]):
 
             shape = scan[i:j+1].T.tolist()[0] + scan[numPoints_shapeModeler+i:numPoints_shapeModeler+j+1].T.tolist()[0]
             shape = downsampleShape(shape, numPoints_shapeModeler)
-            shape = np.reshape(shape,(-1,1))
-            shape = ShapeModeler.normaliseShapeHeight(np.array(shape))
-
-            best_letter = '?'
-            errors = {}
-            values = []
-            for letter in abc:
-                space = spaces[letter]
-                error = space.getMinDist(shape)
-                errors[letter] = error
-                values.append(error)
-
-            best_letter = min(errors, key = errors.get)
-            word.append(best_letter)
+            segments.append(shape)
+
+        if segments:
+            # normalise and classify all the segments at once
+            segments, _ = ShapeModeler.normaliseShapes(np.array(segments), 'height')
+            word = bank.classify(segments)
 
 
         print 'found ' + str(word) 
@@ -0,0 +1,82 @@
+"""
+History of the shapes compared by a ShapeLearner in groupwise mode: the
+parameters of each shape, in the order they were shown, and the sorted values
+of the learned parameter, between the initial bounds.
+
+Both are kept in preallocated numpy buffers, grown by doubling, so that the
+feedback on a shape costs a few vectorized operations whatever the length of
+the session.
+"""
+
+import numpy
+
+# Capacity of the buffers when the history is created
+INITIAL_CAPACITY = 16
+
+
+class ComparisonHistory:
+    def __init__(self, numParams, bounds):
+        """ Empty history of shapes with 'numParams' parameters, the learned
+        parameter being initially bounded by bounds = [min, max]
+        """
+        self.numShapes = 0
+        self.paramsBuffer = numpy.empty((INITIAL_CAPACITY, numParams))
+        # sorted values of the learned parameter, bounds included
+        self.numSortedValues = 2
+        self.sortedBuffer = numpy.empty(INITIAL_CAPACITY + 2)
+        self.sortedBuffer[0:2] = numpy.sort(numpy.ravel(bounds)[0:2])
+
+    def __len__(self):
+        return self.numShapes
+
+    def add(self, params, value):
+        """ Add a shape given by its (numParams x 1) parameters (copied), and
+        the value of its learned parameter
+        """
+        if self.numShapes == len(self.paramsBuffer):
+            paramsBuffer = numpy.empty((2 * len(self.paramsBuffer), self.paramsBuffer.shape[1]))
+            paramsBuffer[0:self.numShapes] = self.paramsBuffer[0:self.numShapes]
+            self.paramsBuffer = paramsBuffer
+            sortedBuffer = numpy.empty(2 * len(self.sortedBuffer))
+            sortedBuffer[0:self.numSortedValues] = self.sortedBuffer[0:self.numSortedValues]
+            self.sortedBuffer = sortedBuffer
+        self.paramsBuffer[self.numShapes] = numpy.ravel(params)
+        self.numShapes += 1
+
+        value = float(numpy.ravel(value)[0])
+        index = numpy.searchsorted(self.sortedValues(), value, side='right')
+        self.sortedBuffer[index + 1:self.numSortedValues + 1] = self.sortedBuffer[index:self.numSortedValues]
+        self.sortedBuffer[index] = value
+        self.numSortedValues += 1
+
+    def params(self):
+        """ (numShapes x numParams) view of the parameters of the shapes
+        """
+        return self.paramsBuffer[0:self.numShapes]
+
+    def getParams(self, index):
+        """ (numParams x 1) parameters of the shape at the given index
+        """
+        return self.paramsBuffer[index].reshape((-1, 1)).copy()
+
+    def sortedValues(self):
+        """ View of the sorted values of the learned parameter, bounds included
+        """
+        return self.sortedBuffer[0:self.numSortedValues]
+
+    def getNeighbours(self, value):
+        """ Return the index in sortedValues of (the last occurrence of) the value,
+        and the values just below and above it
+        """
+        sortedValues = self.sortedValues()
+        index = numpy.searchsorted(sortedValues, value, side='right') - 1
+        return index, sortedValues[index - 1], sortedValues[index + 1]
+
+    def getClosest(self, goalParams):
+        """ Index of the shape whose parameters are closest to the (numParams x 1)
+        goal, comparing the absolute differences lexicographically (first
+        parameter first); the first shape wins ties
+        """
+        errors = abs(self.params() - numpy.ravel(goalParams))
+        # lexsort sorts by its last key first, and is stable
+        return numpy.lexsort(errors.T[::-1])[0]
@@ -0,0 +1,124 @@
+"""
+Class to save a growing dataset of shapes in the text format read by
+ShapeModeler.makeDataMatrix, either by rewriting the whole file at each save
+or, in append-only mode, by writing only the shapes added since the last save.
+"""
+
+import os
+
+# Width of the sample count in the header of files written in append-only
+# mode, so that the count can be updated in place
+COUNT_WIDTH = 10
+
+COUNT_OFFSET = len('nb_sample:\n')
+
+
+def formatShape(shape):
+    return (' '.join(map(str, shape)) + '\n').encode('ascii')
+
+
+class DatasetWriter:
+    def __init__(self, filename, appendOnly=False, fsyncInterval=1):
+        """ Writer for the dataset file 'filename'
+
+        :param appendOnly: if True, only the shapes added since the previous save
+                           are written, and the sample count of the header is
+                           updated in place
+        :param fsyncInterval: in append-only mode, number of saves between two
+                              fsyncs. The sample count of the header is only
+                              updated when the file is synced, so that it never
+                              counts shapes which are not on the disk yet.
+        """
+        self.filename = filename
+        self.appendOnly = appendOnly
+        self.fsyncInterval = fsyncInterval
+        self.numShapesWritten = None # unknown until the file is written once
+        self.numShapesSynced = None
+        self.fileSize = None
+        self.numUnsyncedSaves = 0
+
+    def save(self, refShape, shapes, firstShape=0):
+        """ Save the reference shape followed by the (n x 2m) matrix of shapes
+
+        In append-only mode, the shapes already written by a previous save are
+        assumed unchanged: only the following ones are written. 'shapes' may then
+        start at the index 'firstShape' of the saved shapes, as long as all the
+        previous ones were written.
+        """
+        if (self.appendOnly and self.numShapesWritten is not None
+                and firstShape <= self.numShapesWritten <= firstShape + len(shapes)):
+            self.append(shapes[self.numShapesWritten - firstShape:])
+        elif firstShape > 0:
+            raise RuntimeError("the shapes before " + str(firstShape) + " were not saved in file" + self.filename)
+        else:
+            self.rewrite(refShape, shapes)
+
+    def rewrite(self, refShape, shapes):
+        """ Write the whole file, atomically: it is written under a temporary name,
+        synced, then renamed
+        """
+        if self.appendOnly:
+            count = '%-*i\n' % (COUNT_WIDTH, len(shapes) + 1)
+        else:
+            count = '%i\n' % (len(shapes) + 1)
+        tmpFilename = self.filename + '.tmp'
+        try:
+            with open(tmpFilename, 'wb') as f:
+                f.write(b'nb_sample:\n')
+                f.write(count.encode('ascii'))
+                f.write(b'nb_pts:\n')
+                f.write(('%i\n' % (len(refShape) // 2)).encode('ascii'))
+                f.write(b'ref:\n')
+                f.write(formatShape(refShape))
+                f.write(b'...\n')
+                for shape in shapes:
+                    f.write(formatShape(shape))
+                f.flush()
+                os.fsync(f.fileno())
+                fileSize = f.tell()
+            os.rename(tmpFilename, self.filename)
+        except (IOError, OSError):
+            raise RuntimeError("no writing permission for file"+self.filename)
+
+        self.numShapesWritten = len(shapes)
+        self.numShapesSynced = len(shapes)
+        self.fileSize = fileSize
+        self.numUnsyncedSaves = 0
+
+    def append(self, shapes):
+        """ Write the given shapes at the end of the file
+        """
+        if len(shapes) > 0:
+            try:
+                with open(self.filename, 'r+b') as f:
+                    f.seek(self.fileSize)
+                    f.truncate() # drop anything left by an interrupted save
+                    for shape in shapes:
+                        f.write(formatShape(shape))
+                    self.fileSize = f.tell()
+            except (IOError, OSError):
+                raise RuntimeError("no writing permission for file"+self.filename)
+            self.numShapesWritten += len(shapes)
+
+        self.numUnsyncedSaves += 1
+        if self.numUnsyncedSaves >= self.fsyncInterval:
+            self.flush()
+
+    def flush(self):
+        """ Sync the appended shapes to the disk, then update the sample count
+        of the header
+        """
+        if self.numShapesWritten is None or self.numShapesSynced == self.numShapesWritten:
+            self.numUnsyncedSaves = 0
+            return
+        try:
+            with open(self.filename, 'r+b') as f:
+                os.fsync(f.fileno())
+                f.seek(COUNT_OFFSET)
+                f.write(('%-*i' % (COUNT_WIDTH, self.numShapesWritten + 1)).encode('ascii'))
+                f.flush()
+                os.fsync(f.fileno())
+        except (IOError, OSError):
+            raise RuntimeError("no writing permission for file"+self.filename)
+        self.numShapesSynced = self.numShapesWritten
+        self.numUnsyncedSaves = 0
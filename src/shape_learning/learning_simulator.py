@@ -0,0 +1,122 @@
+"""
+Headless simulation of learning sessions, to tune the settings of ShapeLearner
+offline: each session runs a learner from startLearning until convergence, the
+feedback of the user being simulated by ShapeLearner.generateSimulatedFeedback.
+
+Sessions are independent, and run in parallel in a pool of processes. Their
+results are saved as columns (one array per field) in a .npz file.
+"""
+
+import itertools
+import multiprocessing
+import time
+
+import numpy
+
+from shape_learning.shape_learner import ShapeLearner, SettingsStruct, NUM_PRINCIPLE_COMPONENTS
+
+
+# Fields describing a session, in the order of the columns of the results
+SESSION_FIELDS = ['shape', 'datasetFile', 'paramToVary', 'minParamDiff', 'boundsStdDevMultiple',
+                  'groupwise', 'searchStrategy', 'seed', 'maxIterations']
+
+RESULT_FIELDS = SESSION_FIELDS + ['numIterations', 'converged', 'learnedParamValue', 'wallTime', 'error']
+
+
+def makeSessions(datasetFiles, paramToVary=3, minParamDiffs=(0.4,), boundsStdDevMultiples=(6,),
+                 groupwiseModes=(True,), searchStrategies=('random',), numRepeats=1, maxIterations=100, seed=0):
+    """ Return the list of sessions (dictionaries with the SESSION_FIELDS) of all
+    the combinations of the given settings, each repeated 'numRepeats' times with
+    a different seed
+
+    :param datasetFiles: a dictionary {shape name: initial dataset file}
+    :param boundsStdDevMultiples: the initial bounds of the learned parameter are
+                                  +/- this multiple of its standard deviation
+    """
+    sessions = []
+    for (shape, minParamDiff, boundsStdDevMultiple, groupwise, searchStrategy, repeat) in itertools.product(
+            sorted(datasetFiles.keys()), minParamDiffs, boundsStdDevMultiples, groupwiseModes, searchStrategies,
+            range(numRepeats)):
+        sessions.append({'shape': shape,
+                         'datasetFile': datasetFiles[shape],
+                         'paramToVary': paramToVary,
+                         'minParamDiff': minParamDiff,
+                         'boundsStdDevMultiple': boundsStdDevMultiple,
+                         'groupwise': groupwise,
+                         'searchStrategy': searchStrategy,
+                         'seed': seed + len(sessions),
+                         'maxIterations': maxIterations})
+    return sessions
+
+def simulateSession(session):
+    """ Run one learning session until convergence (or 'maxIterations' feedbacks)
+
+    :returns: the session completed with the result fields; errors raised by the
+              learner are reported in the 'error' field instead of being raised
+    """
+    result = dict(session)
+    result.update({'numIterations': 0, 'converged': False, 'learnedParamValue': numpy.nan, 'error': ''})
+    startTime = time.time()
+    try:
+        settings = SettingsStruct(shape_learning=session['shape'],
+                                  initDatasetFile=session['datasetFile'],
+                                  updateDatasetFiles=[],
+                                  paramFile=None,
+                                  paramsToVary=[session['paramToVary']],
+                                  doGroupwiseComparison=session['groupwise'],
+                                  initialBounds=numpy.array([[numpy.nan, numpy.nan]]),
+                                  initialBounds_stdDevMultiples=numpy.array([[-session['boundsStdDevMultiple'],
+                                                                              session['boundsStdDevMultiple']]]),
+                                  initialParamValue=[0.0] * NUM_PRINCIPLE_COMPONENTS,
+                                  minParamDiff=session['minParamDiff'],
+                                  searchStrategy=session['searchStrategy'])
+        learner = ShapeLearner(settings, rng=session['seed'])
+        #start around a value drawn uniformly between the initial bounds, the other parameters at 0
+        startingParamValue = learner.shapeModeler.rng.uniform(learner.bounds[0, 0], learner.bounds[0, 1])
+        newShape, newParamValue = learner.startLearningAt(learner.bounds, [startingParamValue])
+        while not learner.converged and learner.numIters < session['maxIterations']:
+            bestShape = learner.generateSimulatedFeedback(newShape, newParamValue)
+            if not session['groupwise']:  #pairwise feedback is the index in [best shape, new shape]
+                bestShape = 'new' if bestShape == 1 else 'old'
+            _, newShape, newParamValue = learner.generateNewShapeGivenFeedback(bestShape)
+        result['numIterations'] = learner.numIters
+        result['converged'] = learner.converged
+        result['learnedParamValue'] = float(numpy.ravel(learner.bestParamValue)[0])
+    except Exception as e:
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    result['wallTime'] = time.time() - startTime
+    return result
+
+def runSessions(sessions, numProcesses=None):
+    """ Simulate the sessions in a pool of 'numProcesses' processes (the number of
+    CPUs by default, no pool if 1)
+
+    :returns: the results (see simulateSession), in the order of the sessions
+    """
+    if numProcesses == 1:
+        return [simulateSession(session) for session in sessions]
+    numProcesses = numProcesses or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(numProcesses)
+    try:
+        chunkSize = max(1, len(sessions) // (4 * numProcesses))
+        return pool.map(simulateSession, sessions, chunkSize)
+    finally:
+        pool.close()
+        pool.join()
+
+def saveResults(results, filename):
+    """ Save the results of the sessions as columns, one array per field of
+    RESULT_FIELDS, in a .npz file
+    """
+    columns = dict((field, numpy.array([result[field] for result in results])) for field in RESULT_FIELDS)
+    try:
+        with open(filename, 'wb') as f:
+            numpy.savez(f, **columns)
+    except IOError:
+        raise RuntimeError("no writing permission for file"+filename)
+
+def loadResults(filename):
+    """ Load the columns saved by saveResults, as a dictionary {field: array}
+    """
+    with numpy.load(filename) as data:
+        return dict((field, data[field]) for field in data.files)
@@ -0,0 +1,95 @@
+"""
+Keyed store for the parameters of shapes saved in a 'params.dat' file, which
+is formatted as:
+
+    [a]
+    p1, p2, ..., pk
+    [b]
+    p1, p2, ..., pk
+    ...
+
+(values may also be separated by spaces; lines starting with '#' are comments).
+The file is parsed once per process, and then read and updated in memory.
+"""
+
+from collections import OrderedDict
+import os
+import threading
+
+
+class ParamStore:
+    def __init__(self, filename):
+        """ Load the parameters of all the shapes from 'filename'
+        """
+        self.filename = filename
+        self.comments = []
+        self.params = OrderedDict()
+        self.lock = threading.Lock()
+
+        try:
+            with open(filename, 'r') as f:
+                lines = f.readlines()
+        except IOError:
+            raise RuntimeError("no reading permission for file"+filename)
+
+        name = None
+        for line in lines:
+            line = line.strip()
+            if line.startswith('#'):
+                self.comments.append(line)
+            elif line.startswith('[') and line.endswith(']'):
+                name = line[1:-1]
+            elif line and name is not None:
+                self.params[name] = [float(v) for v in line.replace(',', ' ').split()]
+                name = None
+
+    def __contains__(self, name):
+        return name in self.params
+
+    def getParams(self, name, default=None):
+        """ Return (a copy of) the list of parameters of the shape, or 'default'
+        if unknown
+        """
+        if name not in self.params:
+            return default
+        return list(self.params[name])
+
+    def setParams(self, name, params):
+        """ Set the parameters of the shape (saved with save)
+        """
+        with self.lock:
+            self.params[name] = [float(v) for v in params]
+
+    def save(self):
+        """ Write all the parameters to the file, atomically: the file is written
+        under a temporary name, then renamed
+        """
+        with self.lock:
+            # the parameters may be set by another thread while the file is written
+            items = list(self.params.items())
+        tmpFilename = self.filename + '.tmp'
+        try:
+            with open(tmpFilename, 'w') as f:
+                for comment in self.comments:
+                    f.write(comment + '\n')
+                for name, params in items:
+                    f.write('[' + name + ']\n')
+                    f.write(', '.join(repr(v) for v in params) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmpFilename, self.filename)
+        except (IOError, OSError):
+            raise RuntimeError("no writing permission for file"+self.filename)
+
+
+paramStores = {}
+paramStoresLock = threading.Lock()
+
+def getParamStore(filename):
+    """ Return the ParamStore of the given file, loading it on the first call
+    """
+    key = os.path.abspath(filename)
+    with paramStoresLock:
+        if key not in paramStores:
+            paramStores[key] = ParamStore(filename)
+        return paramStores[key]
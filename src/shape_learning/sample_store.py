@@ -0,0 +1,75 @@
+"""
+Growable storage for the samples of a dataset (one sample per row), used by
+ShapeModeler to add demonstrated shapes without copying the whole dataset
+each time, and to forget old ones.
+"""
+
+import numpy
+
+# Capacity of the buffer after its first reallocation, at least
+MIN_CAPACITY = 16
+
+
+class SampleStore:
+    def __init__(self, samples):
+        """ Initialize the store with a (n x numCoords) array of samples
+
+        The array is used as the initial buffer without being copied (it may
+        be a read-only memory-mapped array). When the buffer is full, it is
+        reallocated with twice its capacity, so that appending a sample has
+        an amortized constant cost.
+        """
+        samples = numpy.asarray(samples)
+        if not samples.ndim == 2:
+            raise RuntimeError("Samples must be given as a (n x numCoords) array")
+
+        self.numSamples = len(samples)
+        self.buffer = samples
+
+    def __len__(self):
+        return self.numSamples
+
+    def capacity(self):
+        return len(self.buffer)
+
+    def reserve(self, capacity):
+        """ Grow the buffer so that it can hold at least 'capacity' samples
+        """
+        if capacity <= len(self.buffer):
+            return
+        newCapacity = max(capacity, 2 * len(self.buffer), MIN_CAPACITY)
+        newBuffer = numpy.empty((newCapacity, self.buffer.shape[1]), dtype=self.buffer.dtype)
+        newBuffer[0:self.numSamples] = self.buffer[0:self.numSamples]
+        self.buffer = newBuffer
+
+    def append(self, sample):
+        """ Add a sample (given as a flat array, a row or a column) and return its index
+        """
+        sample = numpy.reshape(sample, -1)
+        if not len(sample) == self.buffer.shape[1]:
+            raise RuntimeError("Sample must have the same number of coordinates as the stored samples")
+        self.reserve(self.numSamples + 1)
+        self.buffer[self.numSamples] = sample
+        self.numSamples += 1
+        return self.numSamples - 1
+
+    def remove(self, index):
+        """ Remove the sample at the given index
+
+        The samples are copied into a new buffer, so that the views returned by
+        data() before the removal are left unchanged (appending only writes past
+        the samples of these views, so they never change).
+        """
+        if not 0 <= index < self.numSamples:
+            raise RuntimeError("No sample at index " + str(index))
+        newBuffer = numpy.empty(self.buffer.shape, dtype=self.buffer.dtype)
+        newBuffer[0:index] = self.buffer[0:index]
+        newBuffer[index:self.numSamples - 1] = self.buffer[index + 1:self.numSamples]
+        self.buffer = newBuffer
+        self.numSamples -= 1
+
+    def data(self):
+        """ Return the filled part of the buffer, as a view (no copy). The view
+        does not follow the store after the buffer is reallocated.
+        """
+        return self.buffer[0:self.numSamples]
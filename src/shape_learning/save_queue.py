@@ -0,0 +1,78 @@
+"""
+Write-behind queue running the saves of the shape models in a background
+thread, so that the caller (e.g. the UI thread of an application) does not
+wait for the disk.
+
+Saves are queued under a key (typically the saved file): a save queued while
+another one with the same key is still waiting replaces it, so that a file
+saved repeatedly is only written with its latest content.
+"""
+
+from collections import OrderedDict
+import threading
+
+
+class SaveQueue:
+    def __init__(self):
+        self.pending = OrderedDict() # key -> (function, args), oldest first
+        self.condition = threading.Condition()
+        self.saving = False
+        self.closed = False
+        self.error = None # first error raised by a save since the last flush
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, key, function, *args):
+        """ Queue the call function(*args), replacing the call waiting under
+        the same key, if any. The arguments must not be modified afterwards
+        (pass copies of the data to save).
+        """
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Cannot save through a closed save queue")
+            self.pending[key] = (function, args)
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                key, (function, args) = self.pending.popitem(last=False)
+                self.saving = True
+            error = None
+            try:
+                function(*args)
+            except Exception as e:
+                print('save of ' + str(key) + ' failed: ' + str(e))
+                error = e
+            with self.condition:
+                if self.error is None:
+                    self.error = error
+                self.saving = False
+                self.condition.notify_all()
+
+    def flush(self):
+        """ Wait until all the queued saves are done
+
+        Raises a RuntimeError if a save failed since the last flush.
+        """
+        with self.condition:
+            while self.pending or self.saving:
+                self.condition.wait()
+            error, self.error = self.error, None
+        if error is not None:
+            raise RuntimeError("saving failed: " + str(error))
+
+    def close(self):
+        """ Do the queued saves, then stop the background thread
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.flush()
@@ -0,0 +1,112 @@
+"""
+Spatial index (k-d tree) over shapes, built in the PCA coordinates of a
+ShapeModeler, for k-nearest neighbour queries whose cost grows sub-linearly
+with the number of indexed shapes.
+
+Shapes can be added to an index as the dataset grows. Its basis stays the one
+it was built in: the index only has to be recreated once the PCA of the
+growing dataset has drifted too far from it (see MAX_BASIS_DRIFT).
+
+Depends on scipy (imported when the first index is built).
+"""
+
+import numpy
+
+
+# Fraction of shapes added since the tree was built above which it is rebuilt;
+# until then, the added shapes are searched exhaustively
+REBUILD_FRACTION = 0.25
+
+# Drift of the principle components (see ShapeIndex.basisDrift) above which an
+# index must be recreated: below it, the distances computed by the index differ
+# from the ones in the new PCA space by at most this fraction of the distance
+# between the shapes
+MAX_BASIS_DRIFT = 0.05
+
+
+class ShapeIndex:
+    def __init__(self, shapes, meanShape, principleComponents):
+        """ Index a (n x 2m) matrix of shapes, one shape per row
+
+        The shapes are indexed by their parameters for the given mean shape
+        and (orthonormal) principle components: the basis is fixed when the
+        index is created, so the index must be recreated when the PCA drifts
+        too far from it (see basisDrift).
+        """
+        self.meanShape = meanShape
+        self.principleComponents = principleComponents
+        self.points = self.project(shapes)
+        self.numPoints = len(self.points)
+        self.buildTree()
+
+    def project(self, shapes):
+        """ Parameters of a (n x 2m) matrix of shapes in the basis of the index
+        """
+        shapes = numpy.asarray(shapes, dtype=self.principleComponents.dtype)
+        points = numpy.dot(shapes, self.principleComponents)
+        points -= numpy.dot(self.meanShape.T, self.principleComponents)
+        return points
+
+    def basisDrift(self, principleComponents):
+        """ Sine of the largest angle between the space spanned by the given
+        (orthonormal) principle components and the one of the index: the
+        distances between shapes only depend on this space, not on the mean
+        shape nor on the order and signs of the components
+        """
+        basis = self.principleComponents.astype(numpy.float64)
+        principleComponents = numpy.asarray(principleComponents, dtype=numpy.float64)
+        residual = principleComponents - numpy.dot(basis, numpy.dot(basis.T, principleComponents))
+        return numpy.linalg.norm(residual, 2)
+
+    def buildTree(self):
+        from scipy.spatial import cKDTree
+
+        self.tree = cKDTree(self.points[0:self.numPoints])
+        self.numPointsInTree = self.numPoints
+
+    def __len__(self):
+        return self.numPoints
+
+    def add(self, shapes):
+        """ Add a (n x 2m) matrix of shapes to the index; their indices follow
+        the ones of the shapes already indexed
+        """
+        newPoints = self.project(shapes)
+        if self.numPoints + len(newPoints) > len(self.points):
+            capacity = max(self.numPoints + len(newPoints), 2 * len(self.points))
+            points = numpy.empty((capacity, self.points.shape[1]), dtype=self.points.dtype)
+            points[0:self.numPoints] = self.points[0:self.numPoints]
+            self.points = points
+        self.points[self.numPoints:self.numPoints + len(newPoints)] = newPoints
+        self.numPoints += len(newPoints)
+
+        if self.numPoints - self.numPointsInTree > REBUILD_FRACTION * self.numPointsInTree:
+            self.buildTree()
+
+    def query(self, shapes, k=1):
+        """ Find the k nearest indexed shapes of each shape of a (n x 2m) matrix,
+        by euclidian distance between their parameters
+
+        :returns: the (n x k) distances and (n x k) indices of the nearest shapes,
+                  closest first
+        """
+        points = self.project(shapes)
+        k = min(k, self.numPoints)
+        dists, indices = self.tree.query(points, k=min(k, self.numPointsInTree))
+        dists = numpy.reshape(dists, (len(points), -1))
+        indices = numpy.reshape(indices, (len(points), -1))
+
+        if self.numPoints > self.numPointsInTree:
+            # shapes added since the tree was built: exhaustive search
+            pending = self.points[self.numPointsInTree:self.numPoints]
+            diff = points[:, numpy.newaxis, :] - pending[numpy.newaxis, :, :]
+            pendingDists = numpy.sqrt((diff * diff).sum(2))
+            pendingIndices = numpy.arange(self.numPointsInTree, self.numPoints)
+            dists = numpy.hstack((dists, pendingDists))
+            indices = numpy.hstack((indices, numpy.tile(pendingIndices, (len(points), 1))))
+            order = numpy.argsort(dists, 1)[:, 0:k]
+            rows = numpy.arange(len(points))[:, numpy.newaxis]
+            dists = dists[rows, order]
+            indices = indices[rows, order]
+
+        return dists, indices
@@ -6,26 +6,74 @@ Depends on shape_modeler and recordtype.
 """
 
 
-import bisect
 from copy import deepcopy
 
 import numpy
 
-from shape_learning.shape_modeler import ShapeModeler
+from shape_learning.shape_modeler import ShapeModeler, truncatedTriangular
+from shape_learning.comparison_history import ComparisonHistory
 
 
 # shape learning parameters
 
-# Allowed attempts to draw a new shape which is significantly different to the
-# previous one but still within the range (just a precaution; sampling should
-# be theoretically possible)
-maxNumAttempts = 10000
-
 # Tolerance on convergence test
 tol = 1e-2
 
 NUM_PRINCIPLE_COMPONENTS = 5
 
+# Update the shape model with a rank-one PCA update on each demonstration,
+# instead of recomputing the PCA on the whole dataset
+USE_INCREMENTAL_PCA = False
+
+# Directory where the shape models cache their PCA, so that it is not
+# recomputed at each start for unchanged datasets (None to disable)
+PCA_CACHE_DIRECTORY = None
+
+# Floating point type of the shape models (numpy.float32 halves their memory)
+MODEL_DTYPE = numpy.float64
+
+# Only append the new demo shapes to the dataset files when saving, instead
+# of rewriting them (see DatasetWriter)
+APPEND_SAVES = False
+
+# Number of demo shapes kept in the shape models: older demos are forgotten,
+# so that long-running learners have a bounded cost (None to keep them all)
+MAX_DEMO_SHAPES = None
+
+
+def bisectionStep(low, best, high, minParamDiff):
+    """ Value halving the larger of the intervals [low, best] and [best, high],
+    at least minParamDiff away from best (None if there is no such value within
+    the bounds)
+    """
+    return searchStep(low, best, high, minParamDiff, 0.5)
+
+def goldenSectionStep(low, best, high, minParamDiff):
+    """ Value dividing the larger of the intervals [low, best] and [best, high]
+    in the golden ratio (the smaller part next to best), at least minParamDiff
+    away from best (None if there is no such value within the bounds)
+    """
+    return searchStep(low, best, high, minParamDiff, (3 - numpy.sqrt(5)) / 2)
+
+def searchStep(low, best, high, minParamDiff, fraction):
+    """ Value at the given fraction of the larger interval from best
+    """
+    if (high - best) >= (best - low):
+        step = max(fraction * (high - best), minParamDiff)
+        newValue = best + step
+    else:
+        step = max(fraction * (best - low), minParamDiff)
+        newValue = best - step
+    if newValue < low or newValue > high:
+        return None
+    return newValue
+
+# Deterministic strategies choosing the parameter value of the next shape to
+# compare from the bounds and the best value so far. 'random' (the default)
+# draws it from a triangular distribution centred on the best value instead.
+SEARCH_STRATEGIES = {'bisection': bisectionStep,
+                     'golden': goldenSectionStep}
+
 from recordtype import recordtype  #for mutable namedtuple (dict might also work)
 
 SettingsStruct = recordtype('SettingsStruct',
@@ -42,11 +90,18 @@ SettingsStruct = recordtype('SettingsStruct',
                              #Initial acceptable parameter range in terms of the standard deviation of the parameter
                              'initialParamValue',
                              #Initial parameter value (NaN if to be drawn uniformly from initialBounds)
-                             'minParamDiff']) #How different two shapes' parameters need to be to be published for comparison
+                             'minParamDiff', #How different two shapes' parameters need to be to be published for comparison
+                             ('searchStrategy', 'random')]) #How the parameter value of the next shape is chosen: 'random' or one of SEARCH_STRATEGIES
 #@todo: make groupwise comparison/pairwise comparison different implementations of shapeLearner class
 
 class ShapeLearner:
-    def __init__(self, settings):
+    def __init__(self, settings, save_queue=None, rng=None):
+        """ Learner for the shape described by settings (a SettingsStruct)
+
+        :param save_queue: if given, a SaveQueue through which the shape model is saved
+        :param rng: numpy.random.Generator (or seed for one) from which the shapes
+                    of this learner are drawn, to make the learning reproducible
+        """
 
         self.paramsToVary = settings.paramsToVary
         #self.numPrincipleComponents = max(self.paramsToVary)
@@ -56,7 +111,14 @@ class ShapeLearner:
         self.shapeModeler = ShapeModeler(init_filename=settings.initDatasetFile,
                                          update_filenames=settings.updateDatasetFiles,
                                          param_filename=settings.paramFile,
-                                         num_principle_components=self.numPrincipleComponents)
+                                         num_principle_components=self.numPrincipleComponents,
+                                         incremental_pca=USE_INCREMENTAL_PCA,
+                                         pca_cache_dir=PCA_CACHE_DIRECTORY,
+                                         dtype=MODEL_DTYPE,
+                                         append_saves=APPEND_SAVES,
+                                         save_queue=save_queue,
+                                         rng=rng,
+                                         max_demo_shapes=MAX_DEMO_SHAPES)
 
         self.bounds = settings.initialBounds
         for i in range(len(self.paramsToVary)):
@@ -74,6 +136,9 @@ class ShapeLearner:
         self.doGroupwiseComparison = settings.doGroupwiseComparison
         self.shape_learning = settings.shape_learning
         self.minParamDiff = settings.minParamDiff
+        if not (settings.searchStrategy == 'random' or settings.searchStrategy in SEARCH_STRATEGIES):
+            raise RuntimeError("Unknown search strategy " + str(settings.searchStrategy))
+        self.searchStrategy = settings.searchStrategy
 
         self.initialParamValue = settings.initialParamValue
         self.params = numpy.zeros((self.numPrincipleComponents, 1))
@@ -100,13 +165,11 @@ class ShapeLearner:
             self.paramsToVary[0] - 1]  #   USE ONLY FIRST PARAM IN LIST FOR SELF-LEARNING ALGORITHM
 
         if (self.doGroupwiseComparison):
-            self.params_sorted = [self.bounds[0, 0],
-                                  self.bounds[0, 1]] #   USE ONLY FIRST PARAM IN LIST FOR SELF-LEARNING ALGORITHM
-            bisect.insort(self.params_sorted, self.bestParamValue)
-            self.shapeToParamsMapping = [self.params]
+            self.history = ComparisonHistory(self.numPrincipleComponents,
+                                             self.bounds[0]) #   USE ONLY FIRST PARAM IN LIST FOR SELF-LEARNING ALGORITHM
+            self.history.add(self.params, self.bestParamValue)
         else:
             self.newParamValue = self.bestParamValue
-            self.params = [self.newParamValue]
 
         return shape, self.params
 
@@ -121,10 +184,9 @@ class ShapeLearner:
         self.bestParamValue = paramValues[
             self.paramsToVary[0] - 1]  #   USE ONLY FIRST PARAM IN LIST FOR SELF-LEARNING ALGORITHM
         if (self.doGroupwiseComparison):
-            self.params_sorted = [self.bounds[0, 0],
-                                  self.bounds[0, 1]] #   USE ONLY FIRST PARAM IN LIST FOR SELF-LEARNING ALGORITHM
-            bisect.insort(self.params_sorted, self.bestParamValue)
-            self.shapeToParamsMapping = [self.params]
+            self.history = ComparisonHistory(self.numPrincipleComponents,
+                                             self.bounds[0]) #   USE ONLY FIRST PARAM IN LIST FOR SELF-LEARNING ALGORITHM
+            self.history.add(self.params, self.bestParamValue)
         else:
             self.newParamValue = self.bestParamValue
 
@@ -133,28 +195,32 @@ class ShapeLearner:
 
     ### ----------------------------------------------- MAKE DIFFERENT SHAPE
     def makeShapeDifferentTo(self, paramValue):
-        #make new shape to compare with
-        [newShape, newParams] = self.shapeModeler.makeRandomShapeFromTriangular(self.params, self.paramsToVary,
-                                                                                self.bounds, [
-                paramValue])  #USE ONLY FIRST PARAM FOR SELF-LEARNING ALGORITHM ATM
-        newParamValue = newParams[self.paramsToVary[0] - 1, 0] #USE ONLY FIRST PARAM FOR SELF-LEARNING ALGORITHM ATM
-        #ensure it is significantly different
-        numAttempts = 1
-        while (abs(newParamValue - paramValue) < self.minParamDiff and numAttempts < maxNumAttempts):
-            [newShape, newParams] = self.shapeModeler.makeRandomShapeFromTriangular(self.params, self.paramsToVary,
-                                                                                    self.bounds, [
-                    paramValue]) #USE ONLY FIRST PARAM FOR SELF-LEARNING ALGORITHM ATM
-            newParamValue = newParams[
-                self.paramsToVary[0] - 1, 0] #USE ONLY FIRST PARAM FOR SELF-LEARNING ALGORITHM ATM
-            numAttempts += 1
-
-        if (numAttempts >= maxNumAttempts):  #couldn't find a 'different' shape in range
-            print('Oh no!')  #this should be prevented by the convergence test below
+        #draw the new parameter value directly from the triangular distribution over the
+        #bounds, without the values too close to paramValue to be significantly different
+        #(or choose it deterministically with one of SEARCH_STRATEGIES)
+        paramIndex = self.paramsToVary[0] - 1 #USE ONLY FIRST PARAM FOR SELF-LEARNING ALGORITHM ATM
+        mode = float(numpy.ravel(paramValue)[0])
+        if self.searchStrategy == 'random':
+            newParamValues = truncatedTriangular(self.shapeModeler.rng, self.bounds[0, 0], mode, self.bounds[0, 1],
+                                                 mode - self.minParamDiff, mode + self.minParamDiff, 1)
+        else:
+            newParamValue = SEARCH_STRATEGIES[self.searchStrategy](self.bounds[0, 0], mode, self.bounds[0, 1],
+                                                                   self.minParamDiff)
+            newParamValues = None if newParamValue is None else [newParamValue]
+        if newParamValues is None:  #no 'different' shape in range
+            #this should be prevented by the convergence test in generateNewShapeGivenFeedback
+            print('No parameter value within the bounds ' + str(self.bounds[0]) + ' is at least ' +
+                  str(self.minParamDiff) + ' away from ' + str(mode) + ': making a similar shape instead')
+            return self.makeShapeSimilarTo(paramValue)
+
+        newParamValue = newParamValues[0]
+        newParams = numpy.array(self.params, dtype=numpy.float64)
+        newParams[paramIndex, 0] = newParamValue
+        newShape = self.shapeModeler.makeShape(newParams)
 
         #store it as an attempt
         if (self.doGroupwiseComparison):
-            bisect.insort(self.params_sorted, newParamValue)
-            self.shapeToParamsMapping.append(newParams)
+            self.history.add(newParams, newParamValue)
 
         return newShape, newParamValue
 
@@ -168,8 +234,7 @@ class ShapeLearner:
 
         #store it as an attempt
         if (self.doGroupwiseComparison):
-            bisect.insort(self.params_sorted, newParamValue)
-            self.shapeToParamsMapping.append(newParamValues)
+            self.history.add(newParamValues, newParamValue)
 
         return newShape, newParamValue
 
@@ -178,10 +243,9 @@ class ShapeLearner:
         #code in place of feedback from user: go towards goal parameter value
         goalParamValue = numpy.float64(0) #-1.5*parameterVariances[self.paramToVary-1]
         goalParamsValue = numpy.zeros((self.numPrincipleComponents, 1))
-        goalParamsValue[self.paramsToVary - 1, 0] = goalParamValue
+        goalParamsValue[numpy.asarray(self.paramsToVary) - 1, 0] = goalParamValue
         if (self.doGroupwiseComparison):
-            errors = numpy.ndarray.tolist(abs(self.shapeToParamsMapping - goalParamsValue))
-            bestShape_idx = errors.index(min(errors))
+            bestShape_idx = self.history.getClosest(goalParamsValue)
         else:
             errors = [abs(self.bestParamValue - goalParamValue), abs(newParamValue - goalParamValue)]
             bestShape_idx = errors.index(min(errors))
@@ -191,18 +255,17 @@ class ShapeLearner:
     def respondToFeedback(self, bestShape):
         #update bestParamValue based on feedback received
         if (self.doGroupwiseComparison):
-            params_best = self.shapeToParamsMapping[bestShape]
+            params_best = self.history.getParams(bestShape)
 
             self.bestParamValue = params_best[
                 self.paramsToVary[0] - 1, 0]  #USE ONLY FIRST PARAM FOR SELF-LEARNING ALGORITHM ATM
-            bestParamValue_index = bisect.bisect(self.params_sorted,
-                                                 self.bestParamValue) - 1  #indexing seems to start at 1 with bisect
-            newBounds = [self.params_sorted[bestParamValue_index - 1], self.params_sorted[bestParamValue_index + 1]]
+            bestParamValue_index, lowerValue, upperValue = self.history.getNeighbours(self.bestParamValue)
+            newBounds = [lowerValue, upperValue]
 
             #restrict bounds if they were caused by other shapes, because it must be sufficiently different to said shape(s)
             if ((bestParamValue_index - 1) > 0):  #not the default min
                 newBounds[0] += self.minParamDiff
-            if ((bestParamValue_index + 1) < (len(self.params_sorted) - 1)):  #not the default max
+            if ((bestParamValue_index + 1) < (len(self.history.sortedValues()) - 1)):  #not the default max
                 newBounds[1] -= self.minParamDiff
 
             if (not (newBounds[0] > newBounds[1])):  #protect from bounds switching expected order
@@ -213,19 +276,21 @@ class ShapeLearner:
             self.params += diff_params / 2
         else:  #do pairwise comparison with most recent shape and previous
             #restrict limits
+            previousBestParamValue = float(numpy.ravel(self.bestParamValue)[0])
+            newParamValue = float(numpy.ravel(self.newParamValue)[0])
             if ( bestShape == 'new' ):  #new shape is better
-                worstParamValue = self.bestParamValue
-                bestParamValue = self.newParamValue
-                self.params[self.paramsToVary - 1, 0] = bestParamValue
+                worstParamValue = previousBestParamValue
+                bestParamValue = newParamValue
             else:  #new shape is worse
-                worstParamValue = self.newParamValue
-                bestParamValue = self.bestParamValue
-                self.params[self.paramsToVary - 1, 0] = bestParamValue
+                worstParamValue = newParamValue
+                bestParamValue = previousBestParamValue
+            self.params[self.paramsToVary[0] - 1, 0] = bestParamValue
 
-            if ( worstParamValue == min(self.bestParamValue, self.newParamValue) ):  #shape with lower value is worse
-                self.bounds[0] = worstParamValue  #increase min bound to worst so we don't try any lower
+            if ( worstParamValue == min(previousBestParamValue, newParamValue) ):  #shape with lower value is worse
+                self.bounds[0, 0] = worstParamValue  #increase min bound to worst so we don't try any lower
             else:  #shape with higher value is worse
-                self.bounds[1] = worstParamValue  #decrease max bound to worst so we don't try any higher
+                self.bounds[0, 1] = worstParamValue  #decrease max bound to worst so we don't try any higher
+            self.bestParamValue = bestParamValue
 
             ### ------------------------------------------------------------ ITERATE
 
@@ -298,8 +363,8 @@ class ShapeLearner:
         ref_params = self.shapeModeler.refParams
         
         # re-compute parameters of the learned shape and the demo shape in the new PCA-space
-        params_demo, _ = self.shapeModeler.decomposeShape(demo_shape)
-        self.params, _ = self.shapeModeler.decomposeShape(learned_shape)
+        params_demo = self.shapeModeler.projectShape(demo_shape)
+        self.params = self.shapeModeler.projectShape(learned_shape)
         
         # learning :
         diff_params = params_demo - self.params
@@ -312,9 +377,8 @@ class ShapeLearner:
             newParamValue = self.params[
                 self.paramsToVary[0] - 1, 0]  #USE ONLY FIRST PARAM FOR SELF-LEARNING ALGORITHM ATM
             #print('Demo params: '+str(self.params))
-            bisect.insort(self.params_sorted, newParamValue)
-            self.shapeToParamsMapping.append(self.params)
-            #self.respondToFeedback(len(self.params_sorted)-3) # give feedback of most recent shape so bounds modify
+            self.history.add(self.params, newParamValue)
+            #self.respondToFeedback(len(self.history)-1) # give feedback of most recent shape so bounds modify
         return self.shapeModeler.makeShape(self.params), self.params, params_demo
     
     def save_all(self):
@@ -10,6 +10,7 @@ import logging; shapeLogger = logging.getLogger("shape_logger")
 import os.path
 
 from shape_learning.shape_learner import ShapeLearner
+from shape_learning.save_queue import SaveQueue
 from recordtype import recordtype  # for mutable namedtuple (dict might also work)
 
 
@@ -37,7 +38,11 @@ def configure_logging(path):
 
 # ##--------------------------------------------- WORD LEARNING FUNCTIONS
 class ShapeLearnerManager:
-    def __init__(self, generateSettingsFunction, shapes_logging_path = "shapes.log"):
+    def __init__(self, generateSettingsFunction, shapes_logging_path = "shapes.log", async_saves = False):
+        """
+        :param async_saves: if True, the shape learners are saved by a background thread
+                            (call close before exiting, so that the last saves are done)
+        """
 
         configure_logging(shapes_logging_path)
         shapeLogger.info("**************** NEW SESSION ***************")
@@ -52,6 +57,7 @@ class ShapeLearnerManager:
         self.currentCollection = ""
         self.collectionsLearnt = []
         self.nextShapeLearnerToBeStarted = 0
+        self.saveQueue = SaveQueue() if async_saves else None
 
     def initialiseShapeLearners(self):
         self.shapeLearners_currentCollection = []
@@ -70,7 +76,7 @@ class ShapeLearnerManager:
             if (newShape):
                 settings = self.generateSettings(shapeType)
 
-                shapeLearner = ShapeLearner(settings)
+                shapeLearner = ShapeLearner(settings, self.saveQueue)
                 self.shapesLearnt.append(shapeType)
                 self.shapeLearners_all.append(shapeLearner)
                 self.settings_shapeLearners_all.append(settings)
@@ -264,3 +270,16 @@ class ShapeLearnerManager:
             return -1
         else:
             self.shapeLearners_currentCollection[shapeIndex_messageFor].save_params()
+
+    def flush(self):
+        """ Wait until the saves of the shape learners are done
+        """
+        if self.saveQueue is not None:
+            self.saveQueue.flush()
+
+    def close(self):
+        """ Finish the saves of the shape learners, and stop saving in the background
+        """
+        if self.saveQueue is not None:
+            self.saveQueue.close()
+            self.saveQueue = None
@@ -0,0 +1,141 @@
+"""
+Class to score shapes against many ShapeModelers at once (for instance, all
+the letters of an alphabet), by stacking their models into contiguous
+matrices so that a whole batch of shapes is scored with a few matrix
+products instead of a loop over the models.
+
+The bank is a snapshot of the models: it must be rebuilt if they change
+(e.g. after ShapeModeler.extendDataMat).
+"""
+
+import numpy
+
+
+class ShapeModelBank:
+    def __init__(self, shapeModelers):
+        """ Stack the models of the given ShapeModelers
+
+        :param shapeModelers: a dictionary {name: ShapeModeler}. All the models
+                              must have the same number of points and of
+                              principle components.
+        """
+        self.names = sorted(shapeModelers.keys())
+        if not self.names:
+            raise RuntimeError("A shape model bank needs at least one shape model")
+        models = [shapeModelers[name] for name in self.names]
+
+        self.numPointsInShapes = models[0].numPointsInShapes
+        self.num_principle_components = models[0].num_principle_components
+        for model in models:
+            if not (model.numPointsInShapes == self.numPointsInShapes and
+                    model.num_principle_components == self.num_principle_components):
+                raise RuntimeError("All the shape models of a bank must have the same number of points and of principle components")
+        self.dtype = numpy.result_type(*[model.dtype for model in models])
+
+        numModels = len(models)
+
+        # (2m x L) mean shapes and (2m x L*k) principle components, stacked in
+        # one matrix so that a single product gives both the dot products with
+        # the means and the (uncentred) parameters of the shapes for all models
+        self.meanShapes = numpy.hstack([model.meanShape for model in models]).astype(self.dtype)
+        self.projectionMat = numpy.hstack([model.principleComponents for model in models] +
+                                          [self.meanShapes]).astype(self.dtype)
+        self.meanSqNorms = (self.meanShapes * self.meanShapes).sum(0)
+        # P_l^T.mean_l, to centre the parameters after the projection
+        self.meanParams = numpy.vstack([numpy.dot(model.meanShape.T, model.principleComponents)
+                                        for model in models]).astype(self.dtype)
+
+        # cluster centers of all the models, grouped by model
+        centers = []
+        centerParams = []
+        self.clusterStarts = numpy.zeros(numModels, dtype=int)
+        self.clusterOwners = []
+        for i, model in enumerate(models):
+            modelCenters, n_clusters, _ = model.getClusters()
+            self.clusterStarts[i] = len(self.clusterOwners)
+            self.clusterOwners += [i] * n_clusters
+            centers.append(modelCenters)
+            centerParams.append(model.decomposeShapes(numpy.asarray(modelCenters, dtype=model.dtype)))
+        self.clusterOwners = numpy.array(self.clusterOwners)
+        self.clusterCenters = numpy.vstack(centers).astype(self.dtype)
+        self.clusterCenterSqNorms = (self.clusterCenters * self.clusterCenters).sum(1)
+        self.clusterCenterParams = numpy.vstack(centerParams).astype(self.dtype)
+
+    def asShapeMatrix(self, shapes):
+        """ Accept either a single shape as a (2m x 1) column, or a (n x 2m)
+        matrix of shapes, one shape per row, and return the latter
+        """
+        shapes = numpy.asarray(shapes, dtype=self.dtype)
+        if shapes.shape == (self.numPointsInShapes * 2, 1):
+            return shapes.T
+        if not (shapes.ndim == 2 and shapes.shape[1] == self.numPointsInShapes * 2):
+            raise RuntimeError("Shapes must be the same size as shapes used to make the models")
+        return shapes
+
+    def projectShapes(self, shapes):
+        """ Project the shapes onto the models
+
+        :returns: the (n x L x k) parameters of the shapes in each model, and
+                  the (n x L) dot products of the shapes with the mean shapes
+        """
+        projections = numpy.dot(shapes, self.projectionMat)
+        numModels = len(self.names)
+        params = projections[:, 0:numModels * self.num_principle_components]
+        params = params.reshape((len(shapes), numModels, self.num_principle_components))
+        params -= self.meanParams
+        return params, projections[:, numModels * self.num_principle_components:]
+
+    def getMinDists(self, shapes, space='full'):
+        """ Squared distance between each shape and the closest cluster center
+        of each model (see ShapeModeler.getMinDist)
+
+        :param space: 'full' to compare the coordinates of the shapes (as
+                      ShapeModeler.getMinDist), or 'pca' to compare their
+                      parameters in the PCA space of each model
+        :returns: a (n x L) matrix of distances, models ordered as self.names
+        """
+        shapes = self.asShapeMatrix(shapes)
+        if space == 'full':
+            dists = numpy.dot(shapes, self.clusterCenters.T)
+            dists *= -2
+            dists += (shapes * shapes).sum(1)[:, numpy.newaxis]
+            dists += self.clusterCenterSqNorms
+            numpy.maximum(dists, 0, out=dists)
+        elif space == 'pca':
+            params, _ = self.projectShapes(shapes)
+            diff = params[:, self.clusterOwners, :] - self.clusterCenterParams
+            dists = (diff * diff).sum(2)
+        else:
+            raise RuntimeError("Unknown space to compare shapes: " + str(space))
+        return numpy.minimum.reduceat(dists, self.clusterStarts, axis=1)
+
+    def getReconstructionErrors(self, shapes):
+        """ Error of the reconstruction of each shape by each model (see
+        ShapeModeler.decomposeShape), as a (n x L) matrix. The principle
+        components of the models are assumed orthonormal, which requires
+        fewer components than samples in the datasets.
+        """
+        shapes = self.asShapeMatrix(shapes)
+        params, meanDots = self.projectShapes(shapes)
+        # |s - mean|^2 - |P^T (s - mean)|^2, as the components are orthonormal
+        errors = (shapes * shapes).sum(1)[:, numpy.newaxis] - 2 * meanDots + self.meanSqNorms
+        errors -= (params * params).sum(2)
+        numpy.maximum(errors, 0, out=errors)
+        return errors / (self.numPointsInShapes * 2)
+
+    def classify(self, shapes, method='clusters'):
+        """ Return the name of the best model for each shape
+
+        :param method: 'clusters' (closest cluster center), 'clusters_pca'
+                       (closest cluster center in the PCA space of each model)
+                       or 'reconstruction' (smallest reconstruction error)
+        """
+        if method == 'clusters':
+            scores = self.getMinDists(shapes, 'full')
+        elif method == 'clusters_pca':
+            scores = self.getMinDists(shapes, 'pca')
+        elif method == 'reconstruction':
+            scores = self.getReconstructionErrors(shapes)
+        else:
+            raise RuntimeError("Unknown classification method " + str(method))
+        return [self.names[i] for i in numpy.argmin(scores, 1)]
@@ -0,0 +1,164 @@
+"""
+Immutable snapshot of the model of a ShapeModeler (its PCA, the terms derived
+from it and the dataset it was computed from), with the methods which only
+read the model: making, projecting and comparing shapes.
+
+ShapeModeler publishes a new snapshot each time its model changes, by
+replacing a single reference, and never modifies a published one (its arrays
+are read-only). Another thread which got a snapshot with
+ShapeModeler.getSnapshot can thus keep using it, without locks, while the
+model is refitted: it sees the whole previous version of the model, never a
+half-updated one.
+"""
+
+import numpy
+
+
+def readOnly(array):
+    array.setflags(write=False)
+    return array
+
+
+class ShapeModelSnapshot:
+    def __init__(self, version, dataMat, meanShape, principleComponents, parameterVariances):
+        """ Snapshot of a model, given by the (n x 2m) dataset (first row being the
+        reference shape), its (2m x 1) mean shape, its (2m x k) principle components
+        and their variances. The arrays must not be modified afterwards: they are
+        made read-only.
+        """
+        self.version = version
+        self.dataMat = readOnly(dataMat[:]) # read-only view, the dataset itself stays writable
+        self.meanShape = readOnly(meanShape)
+        self.principleComponents = readOnly(principleComponents)
+        self.parameterVariances = readOnly(parameterVariances)
+        self.dtype = principleComponents.dtype
+        self.numPointsInShapes = len(meanShape) // 2
+        self.num_principle_components = principleComponents.shape[1]
+
+        # parameters of a shape: P^T.shape - meanProjection
+        self.meanProjection = readOnly(numpy.dot(principleComponents.T, meanShape))
+        # projection of the reference shape without the mean: the parameter
+        # difference to a shape is then P^T.shape - refProjection
+        self.refProjection = readOnly(numpy.dot(principleComponents.T,
+                                                numpy.reshape(dataMat[0], (-1, 1)).astype(self.dtype)))
+        self.refParams = readOnly(self.refProjection - self.meanProjection)
+        self.refInvVariances = readOnly(1. / numpy.abs(parameterVariances.reshape((-1, 1))))
+
+    def makeShape(self, params):
+        """ Generate a shape with the given parameter vector
+        """
+        if (not params.shape == (self.num_principle_components, 1)):
+            raise RuntimeError("Vector of parameters must have dimensions of (num_principle_components,1)")
+        params = numpy.asarray(params, dtype=self.dtype)
+        shape = self.meanShape + numpy.dot(self.principleComponents, params)
+        return shape
+
+    def makeShapes(self, paramsMat, out=None):
+        """ Generate one shape per row of the (n x num_principle_components) parameter
+        matrix with a single matrix product. The (n x 2m) matrix of shapes, one shape
+        per row, is written into 'out' if given (it must have the dtype of the model).
+        """
+        if (not (paramsMat.ndim == 2 and paramsMat.shape[1] == self.num_principle_components)):
+            raise RuntimeError("Matrix of parameters must have dimensions of (n,num_principle_components)")
+        if out is not None and not out.shape == (len(paramsMat), self.numPointsInShapes * 2):
+            raise RuntimeError("Output matrix must have dimensions of (n,2*numPointsInShapes)")
+        paramsMat = numpy.asarray(paramsMat, dtype=self.dtype)
+        shapes = numpy.dot(paramsMat, self.principleComponents.T, out=out)
+        shapes += self.meanShape.T
+        return shapes
+
+    def projectShape(self, shape, out=None):
+        """ Convert shape into its 'num_principle_components' parameter values,
+        without computing the reconstruction error. Nothing is allocated besides
+        the (num_principle_components x 1) result, which is written into 'out' if
+        given (it must then have the dtype of the model).
+        """
+        if (not shape.shape == (self.numPointsInShapes * 2, 1)):
+            raise RuntimeError("Shape to decompose must be the same size as shapes used to make the dataset "
+                               "(%i points, got a shape of size %s)" % (self.numPointsInShapes, shape.shape))
+        shape = numpy.asarray(shape, dtype=self.dtype)
+        params = numpy.dot(self.principleComponents.T, shape, out=out)
+        params -= self.meanProjection
+        return params
+
+    def getReconstructionError(self, shape, params=None):
+        """ Mean squared error between the shape and its reconstruction from its
+        parameters (computed with projectShape if not given)
+        """
+        if params is None:
+            params = self.projectShape(shape)
+        diff = numpy.asarray(shape, dtype=self.dtype) - self.meanShape
+        diff -= numpy.dot(self.principleComponents, params)
+        return numpy.dot(diff.T, diff)[0, 0] / (self.numPointsInShapes * 2)
+
+    def decomposeShape(self, shape):
+        """ Convert shape into its 'num_principle_components' parameter values
+        (project it onto the num_principle_components-dimensional space), and
+        compute the error of its reconstruction from them
+
+        :returns: the parameters and the reconstruction error (see projectShape and
+                  getReconstructionError to compute only one of them)
+        """
+        params = self.projectShape(shape)
+        return params, self.getReconstructionError(shape, params)
+
+    def decomposeShapes(self, shapes, withError=False):
+        """ Convert a whole (n x 2m) matrix of shapes, one shape per row (as in
+        dataMat, which may be passed directly), into a (n x num_principle_components)
+        matrix of parameter values with a single matrix product.
+
+        If withError is True, also return the n reconstruction errors.
+        """
+        if (not (shapes.ndim == 2 and shapes.shape[1] == self.numPointsInShapes * 2)):
+            raise RuntimeError("Shapes to decompose must be rows of the same size as shapes used to make the dataset")
+        shapes = numpy.asarray(shapes, dtype=self.dtype)
+        # project before centering, so the shapes matrix is never copied
+        params = numpy.dot(shapes, self.principleComponents)
+        params -= self.meanProjection.T
+        if not withError:
+            return params
+
+        diff = shapes - self.meanShape.T
+        diff -= numpy.dot(params, self.principleComponents.T)
+        errors = (diff * diff).mean(1)
+        return params, errors
+
+    def getDistToRef(self, shape, metric='variance', numComponents=1):
+        """ Distance between the parameters of the shape and of the reference
+        shape, over the first 'numComponents' principle components
+
+        :param metric: 'euclidean' for the squared euclidian distance, or 'variance'
+                       for the squared distance normalised by the variance of each
+                       component (Mahalanobis distance in the PCA space)
+        """
+        components = self.principleComponents[:, 0:numComponents]
+        dist = numpy.dot(components.T, shape)
+        dist -= self.refProjection[0:numComponents]
+        dist *= dist
+        if metric == 'variance':
+            dist *= self.refInvVariances[0:numComponents]
+        elif not metric == 'euclidean':
+            raise RuntimeError("Unknown distance metric " + str(metric))
+        return numpy.sum(dist)
+
+    def getDistsToRef(self, shapes, metric='variance', numComponents=None):
+        """ Distances to the reference shape (see getDistToRef) of a (n x 2m)
+        matrix of shapes, one shape per row. All the principle components are
+        used if numComponents is None.
+        """
+        if numComponents is None:
+            numComponents = self.num_principle_components
+        components = self.principleComponents[:, 0:numComponents]
+        dists = numpy.dot(numpy.asarray(shapes, dtype=self.dtype), components)
+        dists -= self.refProjection[0:numComponents].T
+        dists *= dists
+        if metric == 'variance':
+            dists *= self.refInvVariances[0:numComponents].T
+        elif not metric == 'euclidean':
+            raise RuntimeError("Unknown distance metric " + str(metric))
+        return dists.sum(1)
+
+    def getParameterVariances(self):
+        """ Return the variances associated which each of the top principle components
+        """
+        return self.parameterVariances
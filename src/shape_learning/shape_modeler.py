@@ -1,22 +1,164 @@
 """ Class to decompose a dataset of shapes into its principle components,
-and to make and show new shapes which are represented by the mean shape
-plus some amount of said principle components.
-"""
+and to make new shapes which are represented by the mean shape plus some
+amount of said principle components (see shape_plotting to show them).
 
-import random
-from copy import deepcopy
+Depends on numpy. scipy and sklearn are only imported when needed (for the
+'truncated' PCA method and the spatial indices, and for getClusters).
+"""
 
+import hashlib
 import numpy
 import os.path
+import zipfile
+
+from shape_learning.sample_store import SampleStore
+from shape_learning.shape_index import ShapeIndex, MAX_BASIS_DRIFT
+from shape_learning.dataset_writer import DatasetWriter
+from shape_learning.param_store import getParamStore
+from shape_learning.shape_model_snapshot import ShapeModelSnapshot
+
+
+def pcaEigh(centeredData, numComponents):
+    """ Top principle components from the symmetric eigen-decomposition of the
+    covariance matrix
+    """
+    covarMat = numpy.dot(centeredData.T, centeredData) / (len(centeredData) - 1)
+    eigVals, eigVecs = numpy.linalg.eigh(covarMat)
+    order = numpy.argsort(eigVals)[::-1][0:numComponents]
+    return eigVals[order], eigVecs[:, order]
+
+def pcaTruncated(centeredData, numComponents):
+    """ Top principle components computed by a Lanczos solver, without
+    decomposing the whole covariance matrix
+    """
+    from scipy.sparse.linalg import eigsh # slow import, only needed here
+
+    covarMat = numpy.dot(centeredData.T, centeredData) / (len(centeredData) - 1)
+    if numComponents >= len(covarMat):
+        return pcaEigh(centeredData, numComponents)
+    eigVals, eigVecs = eigsh(covarMat, k=numComponents, which='LA', v0=numpy.ones(len(covarMat)))
+    order = numpy.argsort(eigVals)[::-1]
+    return eigVals[order], eigVecs[:, order]
+
+def pcaRandomized(centeredData, numComponents, numOversamples=10, numPowerIters=2):
+    """ Top principle components from a randomized SVD of the data matrix
+    (Halko et al.), without building the covariance matrix
+    """
+    numSamples, numCoords = centeredData.shape
+    rank = min(numComponents + numOversamples, numSamples, numCoords)
+    randomState = numpy.random.RandomState(0)
+    Q, _ = numpy.linalg.qr(numpy.dot(centeredData, randomState.randn(numCoords, rank)))
+    for i in range(numPowerIters):
+        Q, _ = numpy.linalg.qr(numpy.dot(centeredData.T, Q))
+        Q, _ = numpy.linalg.qr(numpy.dot(centeredData, Q))
+    _, singVals, Vt = numpy.linalg.svd(numpy.dot(Q.T, centeredData), full_matrices=False)
+    return padComponents(singVals[0:numComponents] ** 2 / (numSamples - 1), Vt[0:numComponents].T, numComponents)
+
+def pcaGram(centeredData, numComponents):
+    """ Top principle components from the n x n Gram matrix of the samples,
+    cheaper than the covariance matrix when there are fewer samples than coordinates
+    """
+    numSamples = len(centeredData)
+    gramMat = numpy.dot(centeredData, centeredData.T)
+    eigVals, eigVecs = numpy.linalg.eigh(gramMat)
+    order = numpy.argsort(eigVals)[::-1][0:numComponents]
+    eigVals = numpy.maximum(eigVals[order], 0)
+    # null directions of the Gram matrix (up to the rounding errors) do not give principle components
+    nonNull = eigVals > numpy.finfo(numpy.float64).eps * numSamples * eigVals[0]
+    eigVals = eigVals[nonNull]
+    components = numpy.dot(centeredData.T, eigVecs[:, order][:, nonNull]) / numpy.sqrt(eigVals)
+    return padComponents(eigVals / (numSamples - 1), components, numComponents)
+
+def padComponents(variances, components, numComponents):
+    """ Complete the (2m x r) orthonormal components with numComponents - r
+    orthonormal directions of null variance (up to the rounding errors, so that
+    the variances can still be inverted), as pcaEigh returns when the data spans
+    fewer than numComponents dimensions (e.g. with fewer samples)
+    """
+    numMissing = numComponents - components.shape[1]
+    if numMissing <= 0:
+        return variances, components
+    numCoords = len(components)
+    if numComponents > numCoords:
+        raise RuntimeError("Cannot compute " + str(numComponents) + " principle components of shapes with " +
+                           str(numCoords) + " coordinates")
+    # the QR decomposition completes the components into an orthonormal basis
+    Q, _ = numpy.linalg.qr(numpy.hstack([components, numpy.eye(numCoords)]))
+    nullVariance = numpy.finfo(numpy.float64).eps * (variances[0] if len(variances) else 1.)
+    return (numpy.concatenate([variances, numpy.full(numMissing, nullVariance)]),
+            numpy.hstack([components, Q[:, components.shape[1]:numComponents]]))
+
+# PCA backends selectable with the 'pca_method' argument of ShapeModeler. Each
+# takes the centered (n x 2m) data matrix and returns the variances and the
+# (2m x k) principle components, sorted by decreasing variance. 'eig' (the
+# default) keeps the original, unsorted general eigen-decomposition so that
+# previously saved parameters stay valid.
+PCA_METHODS = {'eigh': pcaEigh,
+               'truncated': pcaTruncated,
+               'randomized': pcaRandomized,
+               'gram': pcaGram}
+
+
+def triangular(rng, low, mode, high, size):
+    """ Draw 'size' values from the triangular distributions with the given
+    (broadcastable) limits and modes, inverting the cumulative distribution as
+    random.triangular does: the limits may be equal (the value is then 'low'),
+    and a mode outside of the limits is accepted.
+    """
+    low, mode, high = numpy.broadcast_arrays(*[numpy.asarray(v, dtype=numpy.float64) for v in (low, mode, high)])
+    u = rng.random(size)
+    width = high - low
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        c = numpy.where(width == 0, 0.5, (mode - low) / width)
+    upper = u > c
+    # upper part of the distribution: mirror it
+    u = numpy.where(upper, 1 - u, u)
+    c = numpy.where(upper, 1 - c, c)
+    start = numpy.where(upper, high, low)
+    end = numpy.where(upper, low, high)
+    return start + (end - start) * numpy.sqrt(u * c)
+
+def triangularCdf(x, low, mode, high):
+    """ Cumulative distribution function of the triangular distribution at x, for
+    low <= mode <= high and low < high
+    """
+    if x <= low:
+        return 0.
+    if x >= high:
+        return 1.
+    if x <= mode:
+        return (x - low) ** 2 / ((high - low) * (mode - low))
+    return 1 - (high - x) ** 2 / ((high - low) * (high - mode))
+
+def triangularInverseCdf(u, low, mode, high):
+    c = (mode - low) / (high - low)
+    return numpy.where(u <= c,
+                       low + numpy.sqrt(u * (high - low) * (mode - low)),
+                       high - numpy.sqrt((1 - u) * (high - low) * (high - mode)))
+
+def truncatedTriangular(rng, low, mode, high, excludedLow, excludedHigh, size):
+    """ Draw 'size' values from the triangular distribution with the given limits
+    and mode (clipped to the limits), without the values of the excluded interval
+    ]excludedLow, excludedHigh[: the cumulative distribution of the remaining one
+    or two intervals is inverted directly, without rejection.
+
+    :returns: the values, or None if no value is left between the limits
+    """
+    low, high = float(low), float(high)
+    if not low < high:
+        return None
+    mode = min(max(float(mode), low), high)
+    # probability mass of the intervals [low, excludedLow] and [excludedHigh, high]
+    lowerEnd = min(float(excludedLow), high)
+    upperStart = max(float(excludedHigh), low)
+    lowerMass = triangularCdf(lowerEnd, low, mode, high) if lowerEnd > low else 0.
+    upperMass = 1 - triangularCdf(upperStart, low, mode, high) if upperStart < high else 0.
+    if not lowerMass + upperMass > 0:
+        return None
+    u = rng.random(size) * (lowerMass + upperMass)
+    u = numpy.where(u < lowerMass, u, u - lowerMass + (1 - upperMass))
+    return numpy.clip(triangularInverseCdf(u, low, mode, high), low, high)
 
-import matplotlib.pyplot as plt
-from matplotlib.mlab import PCA
-
-from sklearn.cluster import DBSCAN
-from sklearn import metrics
-from sklearn.datasets.samples_generator import make_blobs
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import MeanShift
 
 class ShapeModeler:
     def __init__(self,
@@ -25,7 +167,16 @@ class ShapeModeler:
                  init_filename=None,
                  update_filenames=None,
                  param_filename=None,
-                 num_principle_components=10):
+                 num_principle_components=10,
+                 incremental_pca=False,
+                 pca_method='eig',
+                 pca_cache_dir=None,
+                 dtype=numpy.float64,
+                 append_saves=False,
+                 fsync_interval=1,
+                 save_queue=None,
+                 rng=None,
+                 max_demo_shapes=None):
         """ Initialize a shape modeler
 
         If given an initial dataset (params samples or init_filename), loads the training
@@ -40,32 +191,81 @@ class ShapeModeler:
                         Each shape must have the same number of coordinates.
         :param filename: the path to a shape dataset. See makeDataMatrix for the expected format.
         :paran num_principle_components: the number of desired principle components
+        :param incremental_pca: if True, demo shapes added with extendDataMat update the
+                                PCA with a rank-one update instead of a full recomputation
+        :param pca_method: 'eig' or one of the backends of PCA_METHODS
+        :param pca_cache_dir: if given, the result of the PCA is cached in this directory,
+                              and reused as long as the dataset does not change
+        :param dtype: floating point type of the dataset and of the model (e.g. numpy.float32
+                      to halve their memory). The eigen-decompositions are run in float64.
+        :param append_saves: if True, save_all and save_demo only append the shapes added
+                             since the previous save to the files (see DatasetWriter)
+        :param fsync_interval: number of appending saves between two syncs to the disk
+        :param save_queue: if given, a SaveQueue through which the saves are done in the
+                           background (save_all, save_demo and save_params then return
+                           without waiting for the disk)
+        :param rng: numpy.random.Generator (or seed for one) used to draw random shapes
+        :param max_demo_shapes: if given, only the last 'max_demo_shapes' demo shapes are kept
+                                in the dataset (sliding window): older ones are forgotten, so
+                                that memory and PCA cost stay bounded. The shapes of the initial
+                                dataset are always kept. The update files still get every demo
+                                shape: they are then only appended to, and a forgotten shape is
+                                written to all of them when it leaves the window.
         """
 
         self.shape_name = shape_name
         self.num_principle_components = num_principle_components
+        self.incremental_pca = incremental_pca
+        if not (pca_method == 'eig' or pca_method in PCA_METHODS):
+            raise RuntimeError("Unknown PCA method " + str(pca_method))
+        self.pca_method = pca_method
+        self.dtype = numpy.dtype(dtype)
+        self.clusters = None # cached result of getClusters, reset when the dataset changes
+        self.sampleIndex = None # spatial indices, built on the first nearest neighbour query
+        self.clusterIndex = None
+        self.clusterIndexSource = None # cluster centers indexed by clusterIndex
+        self.append_saves = append_saves
+        self.fsync_interval = fsync_interval
+        self.datasetWriters = {} # one DatasetWriter per saved file
+        self.save_queue = save_queue
+        self.rng = numpy.random.default_rng(rng)
+        self.max_demo_shapes = max_demo_shapes
+        self.numShapesForgotten = 0 # demo shapes removed from the dataset so far
+        self.numShapesSaved = {} # with a window of demo shapes, shapes handed to the writer of each file
+        self.snapshot = None # published by updateRefParams once the PCA is computed
+        self.snapshotVersion = 0
 
         if samples is None and init_filename is None:
             return
 
         if samples:
-            self.dataMat = numpy.array(samples)
+            self.dataMat = numpy.array(samples, dtype=self.dtype)
+            (self.numShapesInDataset, numCoords) = self.dataMat.shape
+            self.numPointsInShapes = numCoords // 2
+            self.numShapesInDemo = 0
+            self.demoDataMat = numpy.empty((0, numCoords), dtype=self.dtype)
 
         elif init_filename:
             self.makeDataMatrix(init_filename)
 
-        if update_filenames:
-            self.update_filenames = update_filenames
+        # dataMat is a view on the filled part of a growable buffer
+        self.sampleStore = SampleStore(self.dataMat)
+        self.dataMat = self.sampleStore.data()
+
+        if not isinstance(update_filenames,list):
+            update_filenames = [update_filenames] if update_filenames else []
+        self.update_filenames = update_filenames
 
         if param_filename:
             self.param_filename = param_filename
 
-        if not isinstance(update_filenames,list):
-                self.update_filenames = [update_filenames]
-
-        self.performPCA()
-        
-        (self.refParams, error) = self.decomposeShape(numpy.reshape(self.dataMat[0], (-1, 1)))
+        if pca_cache_dir and self.loadPCA(pca_cache_dir):
+            self.updateRefParams()
+        else:
+            self.performPCA()
+            self.updateRefParams()
+            if pca_cache_dir:
+                self.savePCA(pca_cache_dir)
         #self.createNewSet()
 
     def makeDataMatrix(self, filename):
@@ -80,53 +280,238 @@ class ShapeModeler:
             ...
             xn1 xn2 ... xnm yn1 yn2 ... ynm
 
+        or, as written by DatasetWriter, with the labels 'nb_sample:', 'nb_pts:'
+        and 'ref:' before n, m and the first sample, and a '...' line after it.
+        The first sample is the reference shape.
+
+        Files with a .npy extension are read with makeDataMatrixFromBinary.
         """
-        
+        if filename.endswith('.npy'):
+            self.makeDataMatrixFromBinary(filename)
+            return
+
         # scan the dataset :
-        lines = []
         try: 
             with open(filename, 'r') as f:
-                lines.append(f.readline())
-                lines.append(f.readline())
-                nb_samples =  int(lines[1].strip())
-                for i in range(nb_samples+5):
-                    lines.append(f.readline())
+                try:
+                    firstLine = f.readline().strip()
+                    if firstLine.isdigit():
+                        self.numShapesInDataset = int(firstLine)
+                        self.numPointsInShapes = int(f.readline().strip())
+                        sampleLines = [f.readline() for i in range(self.numShapesInDataset)]
+                    else:
+                        self.numShapesInDataset = int(f.readline().strip())
+                        f.readline()
+                        self.numPointsInShapes = int(f.readline().strip())
+                        f.readline()
+                        sampleLines = [f.readline()]
+                        f.readline()
+                        sampleLines += [f.readline() for i in range(self.numShapesInDataset - 1)]
+                except ValueError:
+                    raise RuntimeError("Unable to read sizes needed from text file")
         except IOError:
             raise RuntimeError("no reading permission for file"+filename)
 
-        self.numShapesInDataset = int(lines[1].strip())
-        self.numPointsInShapes = int(lines[3].strip())
         if not (self.numShapesInDataset and self.numPointsInShapes):
             raise RuntimeError("Unable to read sizes needed from text file")
 
         self.numShapesInDemo = 0
-        self.dataMat = numpy.empty((self.numShapesInDataset, self.numPointsInShapes * 2))
-        self.demoDataMat = numpy.empty((self.numShapesInDemo, self.numPointsInShapes * 2))
-        
-        ref_line = lines[5].strip()
-        ref_values =  ref_line.split(' ')
-        if not (len(ref_values) == self.numPointsInShapes * 2):
-            raise RuntimeError("Unable to read appropriate number of points from text file for reference shape ")
-        self.refShape = map(float, ref_values)
-        self.dataMat[0] = self.refShape
-
-        for i in range(self.numShapesInDataset-1): # -1 because we have already add the first shape (reference)
-            line = lines[i+7].strip()
-            values = line.split(' ')
+        self.dataMat = numpy.empty((self.numShapesInDataset, self.numPointsInShapes * 2), dtype=self.dtype)
+        self.demoDataMat = numpy.empty((self.numShapesInDemo, self.numPointsInShapes * 2), dtype=self.dtype)
+
+        for i, line in enumerate(sampleLines):
+            values = line.split()
             if not (len(values) == self.numPointsInShapes * 2):
+                if i == 0:
+                    raise RuntimeError("Unable to read appropriate number of points from text file for reference shape ")
                 raise RuntimeError(
-                    "Unable to read appropriate number of points from text file for shape " + str(i + 1))
-            self.dataMat[i+1] = map(float, values)
+                    "Unable to read appropriate number of points from text file for shape " + str(i))
+            self.dataMat[i] = numpy.array(values, dtype=self.dtype)
+        self.refShape = self.dataMat[0].copy()
+
+    def makeDataMatrixFromBinary(self, filename):
+        """Memory-map a binary dataset written by saveBinaryDataset
+
+        The file is a .npy array of n samples of m points, one sample
+        [x1 ... xm y1 ... ym] per row: its header records n and m, and the
+        first row is the reference shape. Nothing is read from the disk until
+        the samples are used, unless the file has to be converted to the dtype
+        of the model.
+        """
+        try:
+            self.dataMat = numpy.asarray(numpy.load(filename, mmap_mode='r'), dtype=self.dtype)
+        except IOError:
+            raise RuntimeError("no reading permission for file"+filename)
+
+        if not (self.dataMat.ndim == 2 and len(self.dataMat) > 0 and self.dataMat.shape[1] % 2 == 0):
+            raise RuntimeError("Unable to read sizes needed from binary file")
+        self.numShapesInDataset = self.dataMat.shape[0]
+        self.numPointsInShapes = self.dataMat.shape[1] // 2
+
+        self.numShapesInDemo = 0
+        self.demoDataMat = numpy.empty((self.numShapesInDemo, self.numPointsInShapes * 2), dtype=self.dtype)
+        self.refShape = self.dataMat[0]
+
+    def saveBinaryDataset(self, filename):
+        """Save the dataset in the binary format read by makeDataMatrixFromBinary,
+        with the dtype of the model
+        """
+        try:
+            with open(filename, 'wb') as f:
+                numpy.save(f, numpy.asarray(self.dataMat, dtype=self.dtype))
+        except IOError:
+            raise RuntimeError("no writing permission for file"+filename)
 
     def performPCA(self):
         """ Calculate the top 'num_principle_components' principle components of
         the dataset, the observed variance of each component, and the mean
+
+        The decomposition is computed in float64, whatever the dtype of the model.
+        """
+        meanShape = self.dataMat.mean(0, dtype=numpy.float64)
+        centeredData = self.dataMat - meanShape
+        if self.pca_method == 'eig':
+            covarMat = numpy.cov(centeredData.T)
+            eigVals, eigVecs = numpy.linalg.eig(covarMat)
+            principleComponents = numpy.real(eigVecs[:, 0:self.num_principle_components])
+            parameterVariances = numpy.real(eigVals[0:self.num_principle_components])
+        else:
+            (parameterVariances, principleComponents) = \
+                PCA_METHODS[self.pca_method](centeredData, self.num_principle_components)
+        self.meanShape = meanShape.reshape((self.numPointsInShapes * 2, 1)).astype(self.dtype)
+        self.principleComponents = principleComponents.astype(self.dtype)
+        self.parameterVariances = parameterVariances.astype(self.dtype)
+        if self.incremental_pca:
+            # kept in float64, as the running statistics accumulate rounding errors
+            self.scatterMat = numpy.dot(centeredData.T, centeredData)
+
+    def pcaCacheFilename(self, cacheDirectory):
+        """ Return the file caching the PCA of the current dataset in the given
+        directory. It depends on the content of the dataset and on the PCA settings.
+        """
+        key = hashlib.sha1(('%s %d %s %s %s' % (self.datasetHash(),
+                                                 self.num_principle_components,
+                                                 self.pca_method,
+                                                 self.incremental_pca,
+                                                 self.dtype)).encode('ascii')).hexdigest()
+        return os.path.join(cacheDirectory, key + '.npz')
+
+    def savePCA(self, cacheDirectory):
+        """ Cache the result of the PCA (mean shape, principle components, their
+        variances and the reference parameters) in the given directory
+        """
+        results = {'meanShape': self.meanShape,
+                   'principleComponents': self.principleComponents,
+                   'parameterVariances': self.parameterVariances,
+                   'refParams': self.refParams}
+        if self.incremental_pca:
+            results['scatterMat'] = self.scatterMat
+
+        filename = self.pcaCacheFilename(cacheDirectory)
+        tmpFilename = filename + '.tmp'
+        try:
+            if not os.path.isdir(cacheDirectory):
+                os.makedirs(cacheDirectory)
+            with open(tmpFilename, 'wb') as f:
+                numpy.savez(f, **results)
+            os.rename(tmpFilename, filename) # atomic: readers never see a partial file
+        except (IOError, OSError):
+            print('Warning: unable to write the PCA cache file ' + filename)
+
+    def loadPCA(self, cacheDirectory):
+        """ Load the result of the PCA of the current dataset from the given
+        directory, if it was cached with savePCA
+
+        :returns: True if the cached PCA was loaded
+        """
+        filename = self.pcaCacheFilename(cacheDirectory)
+        if not os.path.exists(filename):
+            return False
+        numCoords = self.numPointsInShapes * 2
+        try:
+            with numpy.load(filename) as data:
+                if not (data['meanShape'].shape == (numCoords, 1) and
+                        data['principleComponents'].shape == (numCoords, self.num_principle_components) and
+                        data['parameterVariances'].shape == (self.num_principle_components,) and
+                        data['refParams'].shape == (self.num_principle_components, 1)):
+                    return False
+                if self.incremental_pca:
+                    if 'scatterMat' not in data.files:
+                        return False
+                    self.scatterMat = data['scatterMat']
+                self.meanShape = data['meanShape'].astype(self.dtype)
+                self.principleComponents = data['principleComponents'].astype(self.dtype)
+                self.parameterVariances = data['parameterVariances'].astype(self.dtype)
+                self.refParams = data['refParams'].astype(self.dtype)
+        except (IOError, ValueError, KeyError, EOFError, zipfile.BadZipfile):
+            return False
+        return True
+
+    def updatePCA(self, shape):
+        """ Update the mean, the scatter matrix and the top 'num_principle_components'
+        principle components with one new shape, already appended to the dataset.
+
+        The new covariance is a*C + b*d*d^T, with d the difference between the shape
+        and the previous mean: its top eigenpairs are found in the span of the current
+        components plus the residual of d, so the cost does not depend on the number
+        of shapes in the dataset. The update is computed in float64.
         """
-        covarMat = numpy.cov(self.dataMat.T)
-        eigVals, eigVecs = numpy.linalg.eig(covarMat)
-        self.principleComponents = numpy.real(eigVecs[:, 0:self.num_principle_components])
-        self.parameterVariances = numpy.real(eigVals[0:self.num_principle_components])
-        self.meanShape = self.dataMat.mean(0).reshape((self.numPointsInShapes * 2, 1))
+        numShapes = len(self.dataMat)
+        shape = numpy.asarray(shape, dtype=numpy.float64)
+        principleComponents = self.principleComponents.astype(numpy.float64)
+        delta = shape - self.meanShape
+        meanShape = self.meanShape + delta / numShapes
+        self.scatterMat += numpy.dot(delta, (shape - meanShape).T)
+
+        a = (numShapes - 2.) / (numShapes - 1)
+        b = 1. / numShapes
+        proj = numpy.dot(principleComponents.T, delta)
+        residual = delta - numpy.dot(principleComponents, proj)
+        residualNorm = numpy.linalg.norm(residual)
+
+        numComponents = principleComponents.shape[1]
+        if residualNorm > 1e-10:
+            basis = numpy.hstack((principleComponents, residual / residualNorm))
+            coords = numpy.vstack((proj, [[residualNorm]]))
+        else:
+            basis = principleComponents
+            coords = proj
+        smallCovarMat = b * numpy.dot(coords, coords.T)
+        smallCovarMat[range(numComponents), range(numComponents)] += a * self.parameterVariances
+
+        eigVals, eigVecs = numpy.linalg.eigh(smallCovarMat)
+        order = numpy.argsort(eigVals)[::-1][0:numComponents]
+        self.meanShape = meanShape.astype(self.dtype)
+        self.principleComponents = numpy.dot(basis, eigVecs[:, order]).astype(self.dtype)
+        self.parameterVariances = eigVals[order].astype(self.dtype)
+
+    def downdatePCA(self, shape):
+        """ Remove one shape, already removed from the dataset, from the mean and
+        the scatter matrix, and recompute the principle components from them
+        (incremental mode only). The cost does not depend on the number of shapes.
+        """
+        numShapes = len(self.dataMat)
+        meanShape = self.meanShape - (shape - self.meanShape) / numShapes
+        self.scatterMat -= numpy.dot(shape - meanShape, (shape - self.meanShape).T)
+        self.meanShape = meanShape.astype(self.dtype)
+        self.decomposeScatterMat()
+
+    def refreshPCA(self):
+        """ Recompute exactly the principle components from the running scatter
+        matrix (incremental mode only), e.g. to remove the drift accumulated by
+        rank-one updates. The cost does not depend on the number of shapes.
+        """
+        self.decomposeScatterMat()
+        self.updateRefParams()
+
+    def decomposeScatterMat(self):
+        """ Top principle components of the running scatter matrix
+        """
+        covarMat = self.scatterMat / (len(self.dataMat) - 1)
+        eigVals, eigVecs = numpy.linalg.eigh(covarMat)
+        order = numpy.argsort(eigVals)[::-1][0:self.num_principle_components]
+        self.principleComponents = eigVecs[:, order].astype(self.dtype)
+        self.parameterVariances = eigVals[order].astype(self.dtype)
 
     def getEuclidianCenter(self):
         """ Get the euclidian mean point by point
@@ -141,26 +526,63 @@ class ShapeModeler:
         #sigma =numpy.sqrt(self.parameterVariances)
         return numpy.sum(dist*dist)
 
-    def getDistToRef(self,shape):
-        params1,_ = self.decomposeShape(self.dataMat[0].reshape((self.numPointsInShapes * 2, 1)))
-        params2,_ = self.decomposeShape(shape)
-        dist = numpy.array(params1)-numpy.array(params2)
-        var = numpy.abs(numpy.array(self.getParameterVariances()))
-        ndist = dist*dist/var
-        return numpy.sum(ndist[:1])
+    def updateRefParams(self):
+        """ Publish a new snapshot of the model (see ShapeModelSnapshot), which
+        projects the mean shape and the reference shape (first shape of the
+        dataset) onto the principle components and caches the terms used by
+        projectShape and getDistToRef. Must be called whenever the PCA changes.
+
+        The mean shape, principle components and variances must not be modified
+        in place afterwards (they are made read-only), only replaced.
+        """
+        self.snapshotVersion += 1
+        snapshot = ShapeModelSnapshot(self.snapshotVersion, self.dataMat, self.meanShape,
+                                      self.principleComponents, self.parameterVariances)
+        self.meanProjection = snapshot.meanProjection
+        self.refProjection = snapshot.refProjection
+        self.refParams = snapshot.refParams
+        self.refInvVariances = snapshot.refInvVariances
+        self.snapshot = snapshot # published in a single assignment
+
+    def getSnapshot(self):
+        """ Return the current snapshot of the model, which is never modified:
+        other threads can use it while the model is updated
+        """
+        return self.snapshot
+
+    def getDistToRef(self, shape, metric='variance', numComponents=1):
+        """ Distance between the parameters of the shape and of the reference
+        shape, over the first 'numComponents' principle components
+
+        :param metric: 'euclidean' for the squared euclidian distance, or 'variance'
+                       for the squared distance normalised by the variance of each
+                       component (Mahalanobis distance in the PCA space)
+        """
+        return self.snapshot.getDistToRef(shape, metric, numComponents)
+
+    def getDistsToRef(self, shapes, metric='variance', numComponents=None):
+        """ Distances to the reference shape (see getDistToRef) of a (n x 2m)
+        matrix of shapes, one shape per row. All the principle components are
+        used if numComponents is None.
+        """
+        return self.snapshot.getDistsToRef(shapes, metric, numComponents)
 
     def getParameterVariances(self):
         """ Return the variances associated which each of the top principle components
         """
-        return self.parameterVariances
+        return self.snapshot.getParameterVariances()
 
     def makeShape(self, params):
         """ Generate a shape with the given parameter vector
         """
-        if (not params.shape == (self.num_principle_components, 1)):
-            raise RuntimeError("Vector of parameters must have dimensions of (num_principle_components,1)")
-        shape = self.meanShape + numpy.dot(self.principleComponents, params)
-        return shape
+        return self.snapshot.makeShape(params)
+
+    def makeShapes(self, paramsMat, out=None):
+        """ Generate one shape per row of the (n x num_principle_components) parameter
+        matrix with a single matrix product. The (n x 2m) matrix of shapes, one shape
+        per row, is written into 'out' if given (it must have the dtype of the model).
+        """
+        return self.snapshot.makeShapes(paramsMat, out)
 
     def makeShapeVaryingParam(self, paramsToVary, paramValues):
         """ Generate a shape modifying the given parameter
@@ -171,59 +593,142 @@ class ShapeModeler:
         shape = self.makeShape(xb)
         return shape, xb
 
-    def makeRandomShapeFromUniform(self, params, paramsToVary, bounds):
+    def makeRandomShapeFromUniform(self, params, paramsToVary, bounds, rng=None):
         """ Draw 'paramsToVary' values from uniform distribution with limits
         given by 'bounds' and make shape
         """
-        xb = deepcopy(params)
-        for i in range(len(paramsToVary)):
-            sample = random.uniform(bounds[i, 0], bounds[i, 1])
-            xb[paramsToVary[i] - 1, 0] = sample
-        shape = self.makeShape(xb)
-        return shape, xb
+        shapes, paramsMat = self.makeRandomShapesFromUniform(params, paramsToVary, bounds, 1, rng)
+        return shapes.T, paramsMat.T
 
-    def makeRandomShapeFromTriangular(self, params, paramsToVary, bounds, modes):
+    def makeRandomShapeFromTriangular(self, params, paramsToVary, bounds, modes, rng=None):
         """ Draw 'paramsToVary' values from triangular distribution with limits
         given by 'bounds' and modes given by 'modes' and make shape       
         """
-        b = deepcopy(params)
-        for i in range(len(paramsToVary)):
-            sample = random.triangular(bounds[i, 0], modes[i], bounds[i, 1])
-            b[paramsToVary[i] - 1, 0] = sample
-        return self.makeShape(b), b
+        shapes, paramsMat = self.makeRandomShapesFromTriangular(params, paramsToVary, bounds, modes, 1, rng)
+        return shapes.T, paramsMat.T
+
+    def makeRandomShapesFromUniform(self, params, paramsToVary, bounds, numShapes, rng=None):
+        """ Draw 'numShapes' shapes at once, whose 'paramsToVary' values are drawn from
+        uniform distributions with limits given by 'bounds', the other parameters
+        being the ones of the (num_principle_components x 1) vector 'params'
+
+        :param rng: numpy.random.Generator to draw from (self.rng by default)
+        :returns: the (numShapes x 2m) shapes and (numShapes x num_principle_components) parameters
+        """
+        if rng is None:
+            rng = self.rng
+        bounds = numpy.asarray(bounds, dtype=numpy.float64)
+        paramsMat = self.repeatParams(params, numShapes)
+        paramsMat[:, numpy.asarray(paramsToVary) - 1] = rng.uniform(bounds[:, 0], bounds[:, 1],
+                                                                    (numShapes, len(paramsToVary)))
+        return self.makeShapes(paramsMat), paramsMat
+
+    def makeRandomShapesFromTriangular(self, params, paramsToVary, bounds, modes, numShapes, rng=None):
+        """ Draw 'numShapes' shapes at once, whose 'paramsToVary' values are drawn from
+        triangular distributions with limits given by 'bounds' and modes given by
+        'modes' (see makeRandomShapesFromUniform)
+        """
+        if rng is None:
+            rng = self.rng
+        bounds = numpy.asarray(bounds, dtype=numpy.float64)
+        paramsMat = self.repeatParams(params, numShapes)
+        paramsMat[:, numpy.asarray(paramsToVary) - 1] = triangular(rng, bounds[:, 0], numpy.ravel(modes), bounds[:, 1],
+                                                                   (numShapes, len(paramsToVary)))
+        return self.makeShapes(paramsMat), paramsMat
+
+    def repeatParams(self, params, numShapes):
+        """ (numShapes x num_principle_components) matrix whose rows are the
+        (num_principle_components x 1) vector 'params'
+        """
+        if (not numpy.shape(params) == (self.num_principle_components, 1)):
+            raise RuntimeError("Vector of parameters must have dimensions of (num_principle_components,1)")
+        return numpy.tile(numpy.asarray(params, dtype=numpy.float64).T, (numShapes, 1))
 
     def decomposeShape(self, shape):
         """ Convert shape into its 'num_principle_components' parameter values
-        (project it onto the num_principle_components-dimensional space)
+        (project it onto the num_principle_components-dimensional space), and
+        compute the error of its reconstruction from them
+
+        :returns: the parameters and the reconstruction error (see projectShape and
+                  getReconstructionError to compute only one of them)
+        """
+        return self.snapshot.decomposeShape(shape)
+
+    def projectShape(self, shape, out=None):
+        """ Convert shape into its 'num_principle_components' parameter values,
+        without computing the reconstruction error. Nothing is allocated besides
+        the (num_principle_components x 1) result, which is written into 'out' if
+        given (it must then have the dtype of the model).
+        """
+        return self.snapshot.projectShape(shape, out)
+
+    def getReconstructionError(self, shape, params=None):
+        """ Mean squared error between the shape and its reconstruction from its
+        parameters (computed with projectShape if not given)
         """
-        if (not shape.shape == (self.numPointsInShapes * 2, 1)):
-            print(shape.shape)
-            print(self.numPointsInShapes)
-            raise RuntimeError("Shape to decompose must be the same size as shapes used to make the dataset")
-        params = numpy.dot(self.principleComponents.T, shape - self.meanShape)
+        return self.snapshot.getReconstructionError(shape, params)
 
-        approxShape = self.meanShape + numpy.dot(self.principleComponents, params)
-        diff = abs(shape - approxShape) ** 2
-        error = sum(diff) / (self.numPointsInShapes * 2)
-        return params, error
+    def decomposeShapes(self, shapes, withError=False):
+        """ Convert a whole (n x 2m) matrix of shapes, one shape per row (as in
+        dataMat, which may be passed directly), into a (n x num_principle_components)
+        matrix of parameter values with a single matrix product.
+
+        If withError is True, also return the n reconstruction errors.
+        """
+        return self.snapshot.decomposeShapes(shapes, withError)
 
     def normaliseMeanShapeHeight(self):
-        self.meanShape = ShapeModeler.normaliseShapeHeight(self.meanShape)
+        self.meanShape = ShapeModeler.normaliseShapeHeight(self.meanShape).astype(self.dtype)
+        self.updateRefParams()
 
-    def showMeanShape(self, block=True):
-        ShapeModeler.showShape(ShapeModeler.normaliseShape(self.meanShape), block)
-        
-        
     def extendDataMat(self, shape):
         """ Add the demonstrated shape to the data matrix to performe PCA. 
         We want to update principle components by taking into account the demo shapes.
         """
         self.numShapesInDataset+=1
         self.numShapesInDemo+=1
-        self.dataMat = numpy.append(self.dataMat, shape.T, axis=0)
-        self.demoDataMat = numpy.append(self.demoDataMat, shape.T, axis=0)
-        self.performPCA()
-        (self.refParams, error) = self.decomposeShape(numpy.reshape(self.dataMat[0], (-1, 1)))
+        self.sampleStore.append(shape)
+        self.dataMat = self.sampleStore.data()
+        self.clusters = None
+        if self.sampleIndex is not None:
+            self.sampleIndex.add(shape.T)
+        if self.incremental_pca:
+            self.updatePCA(shape)
+        if self.max_demo_shapes is not None and self.numShapesInDemo > self.max_demo_shapes:
+            self.forgetOldestDemoShape()
+        # the demo shapes are the last rows of the dataset: keep a view, not a copy
+        self.demoDataMat = self.dataMat[self.numShapesInDataset - self.numShapesInDemo:]
+        if not self.incremental_pca:
+            self.performPCA()
+        self.updateRefParams()
+
+    def forgetOldestDemoShape(self):
+        """ Remove the oldest demo shape from the dataset (and from the running
+        statistics of the PCA in incremental mode)
+        """
+        index = self.numShapesInDataset - self.numShapesInDemo
+        shape = numpy.reshape(self.dataMat[index], (-1, 1)).astype(numpy.float64)
+        # write the shape (and the ones before it, if not saved yet) to the update files
+        # while it is in the dataset: the files hold every demo shape
+        for i, filename in enumerate(self.update_filenames):
+            if not os.path.exists(filename):
+                raise RuntimeError("path to dataset"+filename+"not found")
+            self.saveDataset(filename, index - 1 if i == 0 else 0, self.numShapesForgotten + 1)
+        self.sampleStore.remove(index)
+        self.dataMat = self.sampleStore.data()
+        self.numShapesInDataset -= 1
+        self.numShapesInDemo -= 1
+        self.numShapesForgotten += 1
+        self.sampleIndex = None # the following shapes moved: rebuilt on the next query
+        if self.incremental_pca:
+            self.downdatePCA(shape)
+
+    def getDatasetWriter(self, filename):
+        if filename not in self.datasetWriters:
+            # with a window of demo shapes, the forgotten ones can only be appended to the files
+            appendOnly = self.append_saves or self.max_demo_shapes is not None
+            self.datasetWriters[filename] = DatasetWriter(filename, appendOnly, self.fsync_interval)
+        return self.datasetWriters[filename]
 
     def save_all(self):
         """ save the inital shape + the demo shapes into a new dataset.
@@ -233,20 +738,7 @@ class ShapeModeler:
             print('saving in'+filename)
             if not os.path.exists(filename):
                 raise RuntimeError("path to dataset"+filename+"not found")
-            try:
-                with open(filename, 'wb') as f:
-                    f.write('nb_sample:\n')
-                    f.write('%i\n'%self.numShapesInDataset)
-                    f.write('nb_pts:\n')
-                    f.write('%i\n'%self.numPointsInShapes)
-                    f.write('ref:\n')
-                    f.write(' '.join(map(str,self.dataMat[0])) + '\n')
-                    f.write('...\n')
-                    for i in range(len(self.dataMat)-1):
-                        f.write(' '.join(map(str,self.dataMat[i+1])))
-                        f.write('\n')
-            except IOError:
-                raise RuntimeError("no writing permission for file"+filename)
+            self.saveDataset(filename, self.numShapesInDataset - self.numShapesInDemo - 1)
 
     def save_demo(self):
         """ save the demo shape into a new data set.
@@ -255,62 +747,95 @@ class ShapeModeler:
             for filename in self.update_filenames[1:]:
                 if not os.path.exists(filename):
                     raise RuntimeError("path to dataset"+filename+"not found")
-                try:
-                    with open(filename, 'wb') as f:
-                        f.write('nb_sample:\n')
-                        f.write('%i\n'%self.numShapesInDataset)
-                        f.write('nb_pts:\n')
-                        f.write('%i\n'%self.numPointsInShapes)
-                        f.write('ref:\n')
-                        f.write(' '.join(map(str,self.dataMat[0])) + '\n')
-                        f.write('...\n')
-                        for i in range(len(self.dataMat)-1):
-                            f.write(' '.join(map(str,self.demoDataMat[i+1])))
-                            f.write('\n')
-                except IOError:
-                    raise RuntimeError("no writing permission for file"+filename)
+                self.saveDataset(filename, 0)
+
+    def saveDataset(self, filename, numInitialShapes, numDemoShapes=None):
+        """ Save in the file the reference shape, followed by the 'numInitialShapes'
+        next shapes of the initial dataset and by the demo shapes (only the first
+        'numDemoShapes' ones, if given), through the save queue if any.
+
+        With a window of demo shapes, the demo shapes saved include the forgotten
+        ones, which were written when they were forgotten: only the shapes not
+        handed to the writer of the file yet are passed to it.
+        """
+        if numDemoShapes is None:
+            numDemoShapes = self.numShapesForgotten + self.numShapesInDemo
+        numShapes = numInitialShapes + numDemoShapes
+        firstShape = self.numShapesSaved.get(filename, 0) if self.max_demo_shapes is not None else 0
+        if firstShape >= numShapes and firstShape > 0:
+            return
+        # row of the dataset of the first shape to save
+        if firstShape < numInitialShapes:
+            start = 1 + firstShape
+        else:
+            start = (self.numShapesInDataset - self.numShapesInDemo) + (firstShape - numInitialShapes) \
+                    - self.numShapesForgotten
+        shapes = self.dataMat[start:start + numShapes - firstShape]
+        writer = self.getDatasetWriter(filename)
+        if self.save_queue is None:
+            writer.save(self.dataMat[0], shapes, firstShape)
+        else:
+            # snapshot, as the dataset may change before the save is done. With a window, each
+            # save only holds new shapes: it must not replace a pending one (see SaveQueue.put)
+            key = filename if self.max_demo_shapes is None else (filename, firstShape)
+            self.save_queue.put(key, writer.save, numpy.array(self.dataMat[0]), numpy.array(shapes), firstShape)
+        if self.max_demo_shapes is not None:
+            self.numShapesSaved[filename] = numShapes
+
+    def flushSaves(self):
+        """ Sync to the disk the shapes appended by save_all and save_demo
+        (with append_saves and a fsync_interval larger than 1), after the queued
+        saves are done
+        """
+        if self.save_queue is None:
+            for writer in self.datasetWriters.values():
+                writer.flush()
+        else:
+            # the writers are only used by the thread of the queue
+            for filename, writer in self.datasetWriters.items():
+                self.save_queue.put((filename, 'flush'), writer.flush)
+            self.save_queue.flush()
 
     def save_params(self, params, letter):
-        """save parameters in new dataset
+        """save parameters in new dataset (the parameters of the other letters
+        are kept)
         """
         if self.param_filename:
             filename = self.param_filename
             print('saving params in'+filename)
             if not os.path.exists(filename):
                 raise RuntimeError("path to dataset"+filename+"not found")
-            lines = []
-            try:
-                with open(filename, 'rb') as f:
-                    for i in range(52):
-                        lines.append(f.readline())
-            except IOError:
-                raise RuntimeError("no reading permission for file"+filename)
-            try:
-                with open(filename, 'wb') as f:
-                    for i in range(52):
-                        f.write(lines[i])
-                        test = lines[i].replace('[','').replace(']\n','')==letter
-                        if test:
-                            lines[i+1] = str(params).replace('[','').replace(']','')+'\n'
-            except IOError:
-                raise RuntimeError("no writing permission for file"+filename)
-
+            paramStore = getParamStore(filename)
+            paramStore.setParams(letter, params)
+            if self.save_queue is None:
+                paramStore.save()
+            else:
+                self.save_queue.put(filename, paramStore.save)
 
     def paramMatrix(self):
-        paramMat = numpy.zeros((self.numShapesInDataset,self.num_principle_components))
-        for i in range(self.numShapesInDataset):
-            shape = self.dataMat[i,:]
-            params,_ = self.decomposeShape(shape.reshape((self.numPointsInShapes * 2, 1)))
-            paramMat[i,:] = params[:,0]
-        return paramMat
+        return self.decomposeShapes(self.dataMat)
 
     def getVar(self):
         return numpy.var(self.dataMat,0)
 
+    def datasetHash(self):
+        """ Return a hash of the content of the dataset, to validate cached
+        results computed from it
+        """
+        return hashlib.sha1(numpy.ascontiguousarray(self.dataMat).tobytes()).hexdigest()
+
     def getClusters(self):
         """
         get the different clusters of the letter
+
+        The clusters are only computed once, and then cached until the
+        dataset is modified by extendDataMat.
         """
+        if self.clusters is not None:
+            return self.clusters
+
+        from sklearn.cluster import MeanShift # slow import, only needed here
+
         X = self.dataMat
 
         ms = MeanShift(bandwidth=1.9).fit(X)
@@ -322,17 +847,101 @@ class ShapeModeler:
             var.append(numpy.var(X[labels==i]))
         var = numpy.array(var)
 
-        return cluster_centers, n_clusters, var
+        self.clusters = (cluster_centers, n_clusters, var)
+        return self.clusters
+
+    def saveClusters(self, filename):
+        """ Save the clusters of the letter (see getClusters) in a .npz file,
+        alongside a hash of the dataset they were computed from
+        """
+        cluster_centers, n_clusters, var = self.getClusters()
+        try:
+            with open(filename, 'wb') as f:
+                numpy.savez(f, centers=cluster_centers, var=var,
+                            datasetHash=numpy.array(self.datasetHash()))
+        except IOError:
+            raise RuntimeError("no writing permission for file"+filename)
+
+    def loadClusters(self, filename):
+        """ Load clusters previously saved with saveClusters. They are only used
+        if they were computed from the current dataset.
+
+        :returns: True if the clusters were loaded
+        """
+        if not os.path.exists(filename):
+            return False
+        try:
+            with numpy.load(filename) as data:
+                if str(data['datasetHash']) != self.datasetHash():
+                    return False
+                centers = data['centers']
+                if not (centers.ndim == 2 and centers.shape[1] == self.numPointsInShapes * 2):
+                    return False
+                self.clusters = (centers, len(centers), data['var'])
+        except (IOError, ValueError, KeyError, EOFError, zipfile.BadZipfile):
+            # truncated, corrupted or older cache: the clusters are recomputed
+            return False
+        return True
 
     def getMinDist(self,shape):
-        """give the distance between the demo and the closest cluster of the letter"""
+        """give the distance between the demo and the closest cluster of the letter
 
+        The distances in the PCA space of the cluster index are never larger than
+        the full ones: the nearest centers in the index are checked until the next
+        one cannot be closer than the closest found.
+        """
         clusters,_,var = self.getClusters()
-        scores = []
-        for i in range(len(clusters)):
-            dist = (clusters[i,:].reshape((self.numPointsInShapes * 2, 1))-shape)
-            scores.append(numpy.sum(dist*dist))
-        return numpy.min(numpy.array(scores))
+        index = self.getClusterIndex()
+        shape = numpy.reshape(shape, (1, -1))
+        k = 1
+        while True:
+            indexDists, indices = index.query(shape, k)
+            dist = clusters[indices[0]] - shape
+            minDist = numpy.min((dist*dist).sum(1))
+            if k >= len(clusters) or indexDists[0, -1] ** 2 >= minDist:
+                return minDist
+            k *= 2
+
+    def getSampleIndex(self):
+        """ Spatial index of the shapes of the dataset in the PCA space (see
+        ShapeIndex): built on the first call, extended by extendDataMat, and
+        rebuilt when the PCA drifts from its basis by more than MAX_BASIS_DRIFT
+        (or when demo shapes are forgotten)
+        """
+        snapshot = self.snapshot
+        if (self.sampleIndex is None or
+                self.sampleIndex.basisDrift(snapshot.principleComponents) > MAX_BASIS_DRIFT):
+            self.sampleIndex = ShapeIndex(snapshot.dataMat, snapshot.meanShape, snapshot.principleComponents)
+        return self.sampleIndex
+
+    def getClusterIndex(self):
+        """ Spatial index of the cluster centers (see getClusters) in the PCA
+        space, rebuilt when the clusters change or the PCA drifts from its basis
+        by more than MAX_BASIS_DRIFT
+        """
+        clusters,_,_ = self.getClusters()
+        snapshot = self.snapshot
+        if (self.clusterIndex is None or self.clusterIndexSource is not clusters or
+                self.clusterIndex.basisDrift(snapshot.principleComponents) > MAX_BASIS_DRIFT):
+            self.clusterIndex = ShapeIndex(clusters, snapshot.meanShape, snapshot.principleComponents)
+            self.clusterIndexSource = clusters
+        return self.clusterIndex
+
+    def getNearestSamples(self, shapes, k=1):
+        """ Find the k shapes of the dataset nearest to each shape of a (n x 2m)
+        matrix, by distance in the PCA space (see getSampleIndex)
+
+        :returns: the (n x k) distances and (n x k) rows in dataMat of the nearest shapes
+        """
+        return self.getSampleIndex().query(shapes, k)
+
+    def getNearestClusters(self, shapes, k=1):
+        """ Find the k cluster centers (see getClusters) nearest to each shape of
+        a (n x 2m) matrix, by distance in the PCA space (see getClusterIndex)
+
+        :returns: the (n x k) distances and (n x k) indices of the nearest centers
+        """
+        return self.getClusterIndex().query(shapes, k)
 
     def getCenters(self):
 
@@ -342,139 +951,90 @@ class ShapeModeler:
 
 
 
-    @staticmethod
-    def showShape(shape, block=False):
-        """ Show shape with random colour
-        """
-        numPointsInShape = len(shape) / 2
-        x_shape = shape[0:numPointsInShape]
-        y_shape = shape[numPointsInShape:]
-
-        plt.plot(x_shape, -y_shape, c=numpy.random.rand(3, 1))
-        plt.axis([-1, 1, -1, 1])
-        if block:
-            plt.show(block=block)  # block=False <-> plt.draw
-        else:
-            plt.draw()
-
     @staticmethod
     def normaliseShape(shape):
         """ Normalise shape so that max dimension is 1 
         """
-        numPointsInShape = len(shape) / 2
-        x_shape = shape[0:numPointsInShape]
-        y_shape = shape[numPointsInShape:]
-
-        # shift so centre of shape is at (0,0)
-        x_range = max(x_shape) - min(x_shape)
-        y_range = max(y_shape) - min(y_shape)
-        x_shape = x_shape - (max(x_shape) - x_range / 2)
-        y_shape = y_shape - (max(y_shape) - y_range / 2)
-
-        #normalise shape
-        scale = max(x_range, y_range)
-        if scale < 1e-10:
-            print('Warning: shape is probably a bunch of points on top of each other...')
-
-        x_shape = x_shape / scale
-        y_shape = y_shape / scale
-
-        newShape = numpy.zeros(shape.shape)
-        newShape[0:numPointsInShape] = x_shape
-        newShape[numPointsInShape:] = y_shape
-        return newShape
+        return ShapeModeler.normaliseSingleShape(shape, 'max')
 
     @staticmethod
     def getShapeCentre(shape):
         """ Calculate the centre of the shape
         """
-        numPointsInShape = len(shape) / 2
-        x_shape = shape[0:numPointsInShape]
-        y_shape = shape[numPointsInShape:]
-
-        x_range = max(x_shape) - min(x_shape)
-        y_range = max(y_shape) - min(y_shape)
-        x_centre = (max(x_shape) - x_range / 2)
-        y_centre = (max(y_shape) - y_range / 2)
-        return [x_centre, -y_centre]
+        centres = ShapeModeler.getShapesCentre(numpy.reshape(shape, (1, -1)))
+        return [centres[0, 0], centres[0, 1]]
 
     @staticmethod
     def normaliseShapeHeight(shape):
         """ Normalise shape so that height is 1 
         """
-        numPointsInShape = len(shape) / 2
-        x_shape = shape[0:numPointsInShape]
-        y_shape = shape[numPointsInShape:]
-
-        # shift so centre of shape is at (0,0)
-        x_range = max(x_shape) - min(x_shape)
-        y_range = max(y_shape) - min(y_shape)
-        x_centre = (max(x_shape) - x_range / 2)
-        y_centre = (max(y_shape) - y_range / 2)
-        x_shape = x_shape - x_centre
-        y_shape = y_shape - y_centre
-
-        #normalise shape
-        scale = y_range
-        if scale < 1e-10:
-            print('Warning: shape is probably a bunch of points on top of each other...')
-
-        x_shape = x_shape / scale
-        y_shape = y_shape / scale
-
-        newShape = numpy.zeros(shape.shape)
-        newShape[0:numPointsInShape] = x_shape
-        newShape[numPointsInShape:] = y_shape
-        return newShape
+        return ShapeModeler.normaliseSingleShape(shape, 'height')
 
     @staticmethod
     def normaliseShapeWidth(shape):
         """ Normalise shape so that width is 1 
         """
-        numPointsInShape = len(shape) / 2
-        x_shape = shape[0:numPointsInShape]
-        y_shape = shape[numPointsInShape:]
-
-        # shift so centre of shape is at (0,0)
-        x_range = max(x_shape) - min(x_shape)
-        y_range = max(y_shape) - min(y_shape)
-        x_centre = (max(x_shape) - x_range / 2)
-        y_centre = (max(y_shape) - y_range / 2)
-        x_shape = x_shape - x_centre
-        y_shape = y_shape - y_centre
-
-        #normalise shape
-        scale = x_range
-        if scale < 1e-10:
-            print('Warning: shape is probably a bunch of points on top of each other...')
-
-        x_shape = x_shape / scale
-        y_shape = y_shape / scale
+        return ShapeModeler.normaliseSingleShape(shape, 'width')
 
-        newShape = numpy.zeros(shape.shape)
-        newShape[0:numPointsInShape] = x_shape
-        newShape[numPointsInShape:] = y_shape
+    @staticmethod
+    def normaliseSingleShape(shape, dimension):
+        """ Normalise a single shape (as a column or a flat list of coordinates)
+        with normaliseShapes
+        """
+        newShape = numpy.array(shape, dtype=float)
+        _, degenerate = ShapeModeler.normaliseShapes(numpy.reshape(newShape, (1, -1)),
+                                                     dimension, out=numpy.reshape(newShape, (1, -1)))
+        if degenerate[0]:
+            print('Warning: shape is probably a bunch of points on top of each other...')
         return newShape
 
     @staticmethod
-    def normaliseAndShowShape(shape, block=False):
-        """ Normalise shape so that max dimension is 1 and then show
+    def getShapesBoundingBoxes(shapes):
+        """ Calculate the x and y ranges and the x and y centres of the bounding
+        boxes of a (n x 2m) matrix of shapes, one shape per row
         """
-        shape = ShapeModeler.normaliseShape(shape)
-        ShapeModeler.showShape(shape, block)
+        numPointsInShape = shapes.shape[1] // 2
+        x_max = shapes[:, 0:numPointsInShape].max(1)
+        x_range = x_max - shapes[:, 0:numPointsInShape].min(1)
+        y_max = shapes[:, numPointsInShape:].max(1)
+        y_range = y_max - shapes[:, numPointsInShape:].min(1)
+        return x_range, y_range, x_max - x_range / 2, y_max - y_range / 2
 
     @staticmethod
-    def showShape_score(shape, scores, block=False):
-        """ Show shape with random colour
+    def getShapesCentre(shapes):
+        """ Calculate the centres of a (n x 2m) matrix of shapes, one shape per
+        row, as a (n x 2) matrix of [x_centre, -y_centre] (see getShapeCentre)
         """
-        numPointsInShape = len(shape) / 2
-        x_shape = numpy.reshape(numpy.array(shape[0:numPointsInShape]),(numPointsInShape))
-        y_shape = numpy.reshape(numpy.array(shape[numPointsInShape:]),(numPointsInShape))
+        _, _, x_centre, y_centre = ShapeModeler.getShapesBoundingBoxes(shapes)
+        return numpy.column_stack((x_centre, -y_centre))
 
-        #plt.plot(x_shape, -y_shape, c=numpy.random.rand(3, 1))
-        #plt.axis([-1, 1, -1, 1])
-        if block:
-            plt.show(block=block)  # block=False <-> plt.draw
+    @staticmethod
+    def normaliseShapes(shapes, dimension='max', out=None):
+        """ Centre a (n x 2m) matrix of shapes, one shape per row, on (0,0) and
+        scale them so that their max dimension, height or width is 1
+        (dimension = 'max', 'height' or 'width').
+
+        The result is written into 'out' if given, which may be 'shapes' itself.
+        Degenerate shapes (all their points on top of each other) are only centred.
+
+        :returns: the normalised shapes and a boolean mask of the degenerate shapes
+        """
+        x_range, y_range, x_centre, y_centre = ShapeModeler.getShapesBoundingBoxes(shapes)
+        if dimension == 'max':
+            scale = numpy.maximum(x_range, y_range)
+        elif dimension == 'height':
+            scale = y_range
+        elif dimension == 'width':
+            scale = x_range
         else:
-            plt.errorbar(x_shape,-y_shape, yerr=scores/numpy.max(scores))
-            plt.draw()
+            raise RuntimeError("Unknown dimension to normalise shapes: " + str(dimension))
+        degenerate = scale < 1e-10
+        scale[degenerate] = 1.
+
+        if out is None:
+            out = numpy.empty(shapes.shape)
+        numPointsInShape = shapes.shape[1] // 2
+        numpy.subtract(shapes[:, 0:numPointsInShape], x_centre[:, numpy.newaxis], out=out[:, 0:numPointsInShape])
+        numpy.subtract(shapes[:, numPointsInShape:], y_centre[:, numpy.newaxis], out=out[:, numPointsInShape:])
+        out /= scale[:, numpy.newaxis]
+        return out, degenerate
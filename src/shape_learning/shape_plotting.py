@@ -0,0 +1,50 @@
+"""
+Functions to show shapes and shape models with matplotlib.
+
+Kept apart from shape_modeler so that the learning itself does not need
+matplotlib nor a display.
+"""
+
+import numpy
+import matplotlib.pyplot as plt
+
+from shape_learning.shape_modeler import ShapeModeler
+
+
+def showShape(shape, block=False):
+    """ Show shape with random colour
+    """
+    numPointsInShape = len(shape) // 2
+    x_shape = shape[0:numPointsInShape]
+    y_shape = shape[numPointsInShape:]
+
+    plt.plot(x_shape, -y_shape, c=numpy.random.rand(3))
+    plt.axis([-1, 1, -1, 1])
+    if block:
+        plt.show(block=block)  # block=False <-> plt.draw
+    else:
+        plt.draw()
+
+def normaliseAndShowShape(shape, block=False):
+    """ Normalise shape so that max dimension is 1 and then show
+    """
+    shape = ShapeModeler.normaliseShape(shape)
+    showShape(shape, block)
+
+def showMeanShape(shapeModeler, block=True):
+    """ Show the mean shape of a ShapeModeler, normalised
+    """
+    normaliseAndShowShape(shapeModeler.meanShape, block)
+
+def showShape_score(shape, scores, block=False):
+    """ Show shape with error bars proportional to the scores of its points
+    """
+    numPointsInShape = len(shape) // 2
+    x_shape = numpy.reshape(numpy.array(shape[0:numPointsInShape]),(numPointsInShape))
+    y_shape = numpy.reshape(numpy.array(shape[numPointsInShape:]),(numPointsInShape))
+
+    if block:
+        plt.show(block=block)  # block=False <-> plt.draw
+    else:
+        plt.errorbar(x_shape,-y_shape, yerr=scores/numpy.max(scores))
+        plt.draw()
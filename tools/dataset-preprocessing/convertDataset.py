@@ -0,0 +1,37 @@
+"""
+Convert shape datasets from the text format to the binary (.npy) format,
+which ShapeModeler memory-maps instead of parsing. The binary file is
+written next to the text one.
+
+Usage: convertDataset.py <dataset.dat> [<dataset.dat> ...]
+"""
+
+import sys
+import os.path
+
+from shape_learning.shape_modeler import ShapeModeler
+
+
+def convert(filename):
+    shapeModeler = ShapeModeler()
+    shapeModeler.makeDataMatrix(filename)
+    binaryFilename = os.path.splitext(filename)[0] + '.npy'
+    shapeModeler.saveBinaryDataset(binaryFilename)
+    return binaryFilename, shapeModeler.numShapesInDataset
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        print("Usage: convertDataset.py <dataset.dat> [<dataset.dat> ...]")
+        sys.exit(1)
+
+    for filename in sys.argv[1:]:
+        if os.path.basename(filename) == "params.dat":
+            continue
+        try:
+            binaryFilename, numShapes = convert(filename)
+        except RuntimeError as e:
+            print("Skipping %s: %s" % (filename, e))
+            continue
+        print("%s: %d samples written to %s" % (filename, numShapes, binaryFilename))
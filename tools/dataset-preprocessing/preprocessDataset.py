@@ -4,6 +4,8 @@ from scipy import interpolate
 #from scipy.cluster.vq import vq, kmeans, whiten
 from sklearn.cluster import MeanShift
 
+from shape_learning.shape_modeler import ShapeModeler
+
 MIN_CLUSTER_SIZE = 8
 NB_POINTS=70
 
@@ -31,33 +33,6 @@ def interpolate_shape(shape,numDesiredPoints):
 
     return shape
 
-def normalize(shape):
-    """Normalise shape so that max dimension is 1 
-    """
-    numPointsInShape = len(shape)/2
-    x_shape = shape[0:numPointsInShape]
-    y_shape = shape[numPointsInShape:]
-
-    #shift so centre of shape is at (0,0)
-    x_range = max(x_shape)-min(x_shape)
-    y_range = max(y_shape)-min(y_shape)
-    x_shape = x_shape-(max(x_shape)-x_range/2)
-    y_shape = y_shape-(max(y_shape)-y_range/2)
-
-    #normalise shape
-    scale = max(x_range,y_range)
-    if( scale<1e-10):
-        print('Warning: shape is probably a bunch of points on top of each other... Skipping it.')
-        return None
-
-    x_shape = x_shape/scale
-    y_shape = y_shape/scale
-
-    newShape = numpy.zeros(len(shape))
-    newShape[0:numPointsInShape] = x_shape
-    newShape[numPointsInShape:] = y_shape
-    return newShape
-
 def cluster(samples):
 
     samples = numpy.array(samples)
@@ -98,17 +73,21 @@ def preprocess(dataset):
 
         #if char != "S": continue
 
-        for sample in samples:
+        shapes = numpy.empty((len(samples), 2 * NB_POINTS))
+        for j, sample in enumerate(samples):
             sample = list(itertools.chain(*sample))
             #if len(sample) > 1:
             #    # more than one stroke: ignore it for now
             #    continue
 
             #shape = interpolate_shape(sample[0], NB_POINTS)
-            shape = interpolate_shape(sample, NB_POINTS)
-            norm_shape = normalize(shape)
-            if norm_shape is not None:
-                sample_dict.setdefault(char,[]).append(norm_shape)
+            shapes[j] = interpolate_shape(sample, NB_POINTS)
+
+        # normalise all the samples of the character at once
+        norm_shapes, degenerate = ShapeModeler.normaliseShapes(shapes, out=shapes)
+        if degenerate.any():
+            print('Warning: %d shapes are probably a bunch of points on top of each other... Skipping them.' % degenerate.sum())
+        sample_dict.setdefault(char,[]).extend(norm_shapes[~degenerate])
 
     print("Done.\n\nClustering...")
 
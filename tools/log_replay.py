@@ -11,6 +11,8 @@ from collections import OrderedDict
 from shape_learning.shape_learner_manager import ShapeLearnerManager
 from shape_learning.shape_learner import SettingsStruct
 from shape_learning.shape_modeler import ShapeModeler
+from shape_learning import shape_plotting
+from shape_learning.param_store import getParamStore
 
 import os.path
 
@@ -50,26 +52,11 @@ def generateSettings(shapeType):
         except IOError:
                     raise RuntimeError("no writing permission for file"+demo_datasetFile)
 
-    try:
-        datasetParam = init_datasetDirectory + '/params.dat'
-        with open(datasetParam, 'r') as f:
-            line = f.readline()
-            test = line.replace('[','').replace(']\n','')==shapeType
-            while test==False:
-                line = f.readline()
-                if line:
-                    test = line.replace('[','').replace(']\n','')==shapeType
-                else:
-                    break
-            if test:
-                u = f.readline().replace('\n','')
-                initialParamValue = [(float)(s) for s in u.split(',')]
-            else:
-                initialParamValue = 0.0
-                print("parameters not found for shape "+ shapeType +'\n'+'Default : 0.0')
-
-    except IOError:
-        raise RuntimeError("no reading permission for file"+datasetParam)
+    datasetParam = init_datasetDirectory + '/params.dat'
+    initialParamValue = getParamStore(datasetParam).getParams(shapeType)
+    if initialParamValue is None:
+        initialParamValue = 0.0
+        print("parameters not found for shape "+ shapeType +'\n'+'Default : 0.0')
 
     settings = SettingsStruct(shape_learning = shapeType,
                                 paramsToVary = paramsToVary, 
@@ -87,7 +74,7 @@ def generateSettings(shapeType):
 def showShape(shape ):
     plt.figure(1)
     plt.clf()
-    ShapeModeler.normaliseAndShowShape(shape)
+    shape_plotting.normaliseAndShowShape(shape)
 
 if __name__ == "__main__":
 